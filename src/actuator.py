@@ -0,0 +1,119 @@
+from collections import deque
+import logging
+import threading
+import time
+
+import serial
+
+
+logger = logging.getLogger(__name__)
+
+
+class ActuatorChannel():
+    # Serial actuator driven by background writer thread, so slow UART
+    # writes never block the caller.
+    #
+    # Position commands are last-value-wins: only the newest one not yet
+    # written is kept. Discrete commands (e.g. 'blink') are queued and never
+    # dropped; they are written before pending position. At most 'rate'
+    # commands per second are written (no limit if rate is None).
+
+    def __init__(self, uartdev, baudrate=9600, rate=None):
+        self.uartdev = uartdev
+
+        if rate is None:
+            self.min_interval = 0
+        else:
+            self.min_interval = 1 / rate
+
+        self._ser = self._get_serial(baudrate)
+
+        self._position = None
+        self._commands = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.n_written = 0
+        self.n_coalesced = 0
+        self.n_failures = 0
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _get_serial(self, baudrate):
+        try:
+            return serial.Serial(self.uartdev, baudrate, timeout=1)
+        except:
+            raise Exception(f"Failed to open UART device '{self.uartdev}'.") from None
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    @property
+    def queue_depth(self):
+        return len(self._commands) + (self._position is not None)
+
+    def set_position(self, cmd):
+        with self._cond:
+            if self._position is not None:
+                self.n_coalesced += 1
+
+            self._position = cmd
+            self._cond.notify()
+
+    def send(self, cmd):
+        with self._cond:
+            self._commands.append(cmd)
+            self._cond.notify()
+
+    def _next_cmd(self):
+        with self._cond:
+            while (not self._closed) and \
+                  (not self._commands) and \
+                  (self._position is None):
+                self._cond.wait()
+
+            if self._closed:
+                return
+
+            if self._commands:
+                return self._commands.popleft()
+
+            cmd = self._position
+            self._position = None
+            return cmd
+
+    def _run(self):
+        next_t = time.monotonic()
+        while True:
+            # Position commands issued while waiting are coalesced.
+            delay = next_t - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            cmd = self._next_cmd()
+            if cmd is None:
+                return
+
+            try:
+                self._ser.write(cmd)
+                self.n_written += 1
+            except Exception as e:
+                self.n_failures += 1
+                logger.error(f"Failed to write to '{self.uartdev}'\n{e}")
+
+            next_t = time.monotonic() + self.min_interval
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+
+            self._closed = True
+            self._cond.notify()
+
+        self._thread.join(timeout=1)
+        self._ser.close()
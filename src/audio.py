@@ -1,8 +1,27 @@
+from array import array
+from bisect import bisect_right
+from collections import namedtuple, OrderedDict
+import logging
+import mmap
 from pathlib import Path
+import struct
 import subprocess
+import threading
 import time
 
 
+logger = logging.getLogger(__name__)
+
+
+BACKENDS = ["aplay", "alsa"]
+
+# Mark offsets (seconds, sorted) and corresponding position names.
+Marks = namedtuple("Marks", ["offsets", "names"])
+
+WavInfo = namedtuple("WavInfo",
+    ["channels", "rate", "sample_width", "data_offset", "data_size"])
+
+
 def get_files(path):
     d = Path(path)
 
@@ -13,19 +32,348 @@ def get_files(path):
 
     return files
 
-def play(dev, path):
-    return subprocess.Popen(['aplay', f'-D{dev}', path])
+def parse_wav_header(buf):
+    if (len(buf) < 12) or (buf[0:4] != b"RIFF") or (buf[8:12] != b"WAVE"):
+        raise ValueError("Not a WAV file")
 
-def killall():
-    p = subprocess.Popen(['killall', 'aplay'])
-    while True:
-        if p.poll() is not None:
-            if p.returncode == 0:
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id = bytes(buf[pos:pos+4])
+        chunk_size = struct.unpack_from("<I", buf, pos+4)[0]
+        body = pos + 8
+
+        if chunk_id == b"fmt ":
+            audio_format, channels, rate, _, _, bits = \
+                struct.unpack_from("<HHIIHH", buf, body)
+            if audio_format not in [1, 0xFFFE]:
+                raise ValueError(f"Unsupported WAV format {audio_format} (PCM expected)")
+            fmt = (channels, rate, bits // 8)
+
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("No format chunk before data chunk")
+
+            data_size = min(chunk_size, len(buf) - body)
+            return WavInfo(*fmt, body, data_size)
+
+        pos = body + chunk_size + (chunk_size & 1)
+
+    raise ValueError("No data chunk")
+
+class WavClip():
+    # WAV file loaded into memory with validated header.
+
+    def __init__(self, path, data, info, mtime=None):
+        self.path = Path(path)
+        self.data = data
+        self.info = info
+        self.mtime = mtime
+
+    @classmethod
+    def load(cls, path):
+        mtime = Path(path).stat().st_mtime_ns
+        data = Path(path).read_bytes()
+        info = parse_wav_header(data)
+        return cls(path, data, info, mtime)
+
+    def changed(self):
+        # True if file was modified (or removed) since it was loaded.
+        try:
+            return Path(self.path).stat().st_mtime_ns != self.mtime
+        except OSError:
+            return True
+
+    @property
+    def size(self):
+        return len(self.data)
+
+class WavCache():
+    # In-memory WAV clips up to memory budget (bytes) with LRU eviction.
+    # Used from player worker threads, hence the lock.
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+
+        self._clips = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.n_hits = 0
+        self.n_misses = 0
+
+    def __contains__(self, path):
+        return Path(path) in self._clips
+
+    def get(self, path):
+        # Returns cached clip or None.
+
+        path = Path(path)
+        with self._lock:
+            clip = self._clips.get(path)
+            if clip is not None:
+                self._clips.move_to_end(path)
+                self.n_hits += 1
+
+            return clip
+
+    def _add(self, clip, evict=True):
+        with self._lock:
+            if clip.path in self._clips:
                 return True
-            else:
+
+            if clip.size > self.budget:
                 return False
 
-        time.sleep(1)
+            while self.size + clip.size > self.budget:
+                if not evict:
+                    return False
+
+                _, old = self._clips.popitem(last=False)
+                self.size -= old.size
+
+            self._clips[clip.path] = clip
+            self.size += clip.size
+            return True
+
+    def load(self, path):
+        # Returns cached clip, loading (and caching) it on miss.
+
+        clip = self.get(path)
+        if clip is not None:
+            return clip
+
+        self.n_misses += 1
+        clip = WavClip.load(path)
+        self._add(clip)
+        return clip
+
+    def preload(self, paths):
+        # Loads clips until budget is full, without evicting. Invalid files
+        # and files not fitting into the rest of budget are skipped.
+
+        for path in paths:
+            if self.size >= self.budget:
+                break
+
+            if path in self:
+                continue
+
+            try:
+                if Path(path).stat().st_size > self.budget - self.size:
+                    continue
+
+                clip = WavClip.load(path)
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Failed to preload '{path}'\n{e}")
+                continue
+
+            self._add(clip, evict=False)
+
+    def retain(self, paths):
+        # Drops clips of files not in paths and of files changed since
+        # loaded.
+
+        paths = set(Path(p) for p in paths)
+        with self._lock:
+            clips = list(self._clips.values())
+
+        for clip in clips:
+            if (clip.path in paths) and not clip.changed():
+                continue
+
+            with self._lock:
+                if self._clips.pop(clip.path, None) is not None:
+                    self.size -= clip.size
+
+    def clear(self):
+        with self._lock:
+            self._clips.clear()
+            self.size = 0
+
+class AplayPlayer():
+    # Plays file with 'aplay' subprocess. Position is estimated from the
+    # time the process was started.
+    #
+    # With cache, clip data is fed to aplay via stdin from memory, so the
+    # file is not read from disk on every playback.
+
+    def __init__(self, dev, path, cache=None):
+        self.path = Path(path)
+
+        if cache is None:
+            self._proc = subprocess.Popen(['aplay', f'-D{dev}', path])
+        else:
+            self._proc = subprocess.Popen(['aplay', f'-D{dev}', '-'],
+                                          stdin=subprocess.PIPE)
+            self._feeder = threading.Thread(
+                target=self._feed, args=(cache,), daemon=True)
+            self._feeder.start()
+
+        self._start_t = time.monotonic()
+
+    def _feed(self, cache):
+        try:
+            clip = cache.load(self.path)
+            self._proc.stdin.write(clip.data)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to play '{self.path}'\n{e}")
+            self._proc.terminate()
+        finally:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def poll(self):
+        return self._proc.poll()
+
+    @property
+    def returncode(self):
+        return self._proc.returncode
+
+    @property
+    def position(self):
+        return time.monotonic() - self._start_t
+
+    def stop(self):
+        self._proc.terminate()
+
+class AlsaPlayer():
+    # Plays WAV file in-process: memory-mapped PCM data is streamed to ALSA
+    # device by worker thread. Requires 'pyalsaaudio' package.
+    #
+    # Position is derived from frames handed to ALSA: blocking write returns
+    # as soon as there is room for a period, so at that moment the device
+    # buffer still holds about BUFFER_FRAMES not yet played frames.
+
+    PERIOD_FRAMES = 1024
+    N_PERIODS = 4
+    BUFFER_FRAMES = PERIOD_FRAMES * N_PERIODS
+
+    def __init__(self, dev, path, cache=None):
+        self.dev = dev
+        self.path = Path(path)
+        self.cache = cache
+
+        self.returncode = None
+        self.info = None
+
+        # (seconds written, monotonic time of write) replaced atomically.
+        self._written = (0.0, None)
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _open_pcm(self):
+        try:
+            import alsaaudio
+        except ImportError:
+            raise Exception("Package 'pyalsaaudio' is required for 'alsa' audio backend") from None
+
+        formats = {
+            1: alsaaudio.PCM_FORMAT_U8,
+            2: alsaaudio.PCM_FORMAT_S16_LE,
+            3: alsaaudio.PCM_FORMAT_S24_3LE,
+            4: alsaaudio.PCM_FORMAT_S32_LE,
+        }
+        if self.info.sample_width not in formats:
+            raise Exception(f"Unsupported sample width {self.info.sample_width} of '{self.path}'")
+
+        return alsaaudio.PCM(alsaaudio.PCM_PLAYBACK,
+                             device=self.dev,
+                             channels=self.info.channels,
+                             rate=self.info.rate,
+                             format=formats[self.info.sample_width],
+                             periodsize=self.PERIOD_FRAMES,
+                             periods=self.N_PERIODS)
+
+    def _run(self):
+        pcm = None
+        try:
+            if self.cache is not None:
+                clip = self.cache.load(self.path)
+                with memoryview(clip.data) as view:
+                    self.info = clip.info
+                    pcm = self._open_pcm()
+                    self._stream(pcm, view)
+            else:
+                with self.path.open("rb") as f:
+                    buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+                with buf, memoryview(buf) as view:
+                    self.info = parse_wav_header(view)
+                    pcm = self._open_pcm()
+                    self._stream(pcm, view)
+
+            self.returncode = -15 if self._stop.is_set() else 0
+        except Exception as e:
+            logger.error(f"Failed to play '{self.path}'\n{e}")
+            self.returncode = 1
+        finally:
+            if pcm is not None:
+                pcm.close()
+
+    def _stream(self, pcm, view):
+        info = self.info
+        frame_size = info.channels * info.sample_width
+        chunk_size = self.PERIOD_FRAMES * frame_size
+        data = view[info.data_offset:info.data_offset+info.data_size]
+
+        n_frames = 0
+        for pos in range(0, len(data), chunk_size):
+            if self._stop.is_set():
+                return
+
+            chunk = data[pos:pos+chunk_size]
+            if len(chunk) < chunk_size:
+                # Last period is padded with silence.
+                chunk = bytes(chunk) + bytes(chunk_size - len(chunk))
+
+            pcm.write(chunk)
+            n_frames += self.PERIOD_FRAMES
+            self._written = (n_frames / info.rate, time.monotonic())
+
+        # Wait until buffered frames are played.
+        if hasattr(pcm, "drain"):
+            pcm.drain()
+        else:
+            time.sleep(self.BUFFER_FRAMES / info.rate)
+
+    def poll(self):
+        return self.returncode
+
+    @property
+    def position(self):
+        # Playback position in seconds.
+
+        written, t = self._written
+        if t is None:
+            return 0.0
+
+        queued = self.BUFFER_FRAMES / self.info.rate
+        position = written - queued + (time.monotonic() - t)
+        return max(0.0, min(position, written))
+
+    def stop(self):
+        self._stop.set()
+
+def play(dev, path, backend="aplay", cache=None):
+    # Returns player with Popen-like poll()/returncode and playback position.
+
+    if backend == "alsa":
+        return AlsaPlayer(dev, path, cache)
+    elif backend == "aplay":
+        return AplayPlayer(dev, path, cache)
+    else:
+        raise ValueError(f"Audio backend must be one of the following: {', '.join(BACKENDS)}.")
+
+def killall():
+    p = subprocess.Popen(['killall', 'aplay'])
+    return p.wait() == 0
 
 def load_marks(path):
     # mark format: offset in seconds, position name
@@ -38,6 +386,150 @@ def load_marks(path):
     marks = [[float(m[0]), m[1]] for m in marks]
     return marks
 
+def load_marks_array(path):
+    marks = sorted(load_marks(path), key=lambda m: m[0])
+    offsets = array('d', [m[0] for m in marks])
+    names = tuple(m[1] for m in marks)
+    return Marks(offsets, names)
+
+class MarkTimeline():
+    # Cursor over marks driven by elapsed playback time. Current mark is
+    # found by binary search, so a late tick jumps straight to the newest
+    # reached mark; overtaken marks are skipped (counted in n_skipped).
+
+    def __init__(self, marks):
+        self.offsets = marks.offsets
+        self.names = marks.names
+
+        self._index = 0
+        self.n_skipped = 0
+
+    @property
+    def done(self):
+        return self._index >= len(self.offsets)
+
+    @property
+    def next_offset(self):
+        if self.done:
+            return
+
+        return self.offsets[self._index]
+
+    def seek(self, elapsed):
+        # Moves cursor to given time without returning marks.
+        self._index = bisect_right(self.offsets, elapsed)
+
+    def advance(self, elapsed):
+        # Returns name of the newest mark reached since the previous call,
+        # or None if no new mark was reached.
+
+        if self.done or (elapsed < self.offsets[self._index]):
+            return
+
+        i = bisect_right(self.offsets, elapsed, self._index)
+        self.n_skipped += i - self._index - 1
+        self._index = i
+
+        return self.names[i-1]
+
+class MediaCatalog():
+    # Index of audio files and their parsed marks. Directory is rescanned
+    # only when its mtime changes (adding, removing or renaming files;
+    # editing a marks file in place is not detected). If cache is given,
+    # it is updated by background thread after every rescan: clips of
+    # removed or changed files are dropped and new ones preloaded, so disk
+    # is not read on caller's thread.
+
+    def __init__(self, path, cache=None):
+        self.path = Path(path)
+        self.cache = cache
+
+        self._mtime = None
+        self._files = []
+        self._marks = {}
+
+        self._preload_request = threading.Event()
+        self._preload_stop = threading.Event()
+        self._preloader = None
+
+        self.refresh()
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    def close(self):
+        # Preload thread exits after the current pass; it is not joined, so
+        # caller never waits for disk reads.
+
+        if self._preloader is None:
+            return
+
+        self._preload_stop.set()
+        self._preload_request.set()
+        self._preloader = None
+
+    def _request_preload(self):
+        if self._preload_stop.is_set():
+            return
+
+        self._preload_request.set()
+
+        if self._preloader is None:
+            self._preloader = threading.Thread(
+                target=self._preload_loop, daemon=True)
+            self._preloader.start()
+
+    def _preload_loop(self):
+        # Rescans made while preloading are coalesced into one more pass.
+
+        while True:
+            self._preload_request.wait()
+            self._preload_request.clear()
+            if self._preload_stop.is_set():
+                return
+
+            files = self._files
+            try:
+                self.cache.retain(files)
+                self.cache.preload(files)
+            except Exception as e:
+                logger.error(f"Failed to preload audio files\n{e}")
+
+    def refresh(self):
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+
+        if (mtime is not None) and (mtime == self._mtime):
+            return False
+
+        self._mtime = mtime
+        self._files = get_files(self.path)
+
+        self._marks = {}
+        for f in self._files:
+            try:
+                self._marks[f] = load_marks_array(f)
+            except (OSError, ValueError, IndexError):
+                pass
+
+        if self.cache is not None:
+            self._request_preload()
+
+        return True
+
+    def get_files(self):
+        self.refresh()
+        return self._files.copy()
+
+    def get_marks(self, path):
+        # Returns None if audio file has no (valid) marks.
+        return self._marks.get(Path(path))
+
 if __name__ == "__main__":
     import sys
 
@@ -53,10 +545,15 @@ if __name__ == "__main__":
         print("No argument for audio file provided")
         sys.exit(1)
 
-    p = play(dev, path)
+    try:
+        backend = sys.argv[3]
+    except:
+        backend = "aplay"
+
+    p = play(dev, path, backend)
     while True:
         time.sleep(1)
-        print('Playing...')
+        print(f'Playing... {p.position:.2f} s')
         if p.poll() is not None:
             print(f"Finished with return code {p.returncode}.")
             break
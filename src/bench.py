@@ -0,0 +1,337 @@
+from datetime import datetime
+import json
+import math
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import audio
+from controller import Controller
+from mpv_client import MPVClient
+from radar_capture import HEADER, RECORD, CaptureWriter, LD2450Replay
+from radar_ld2450 import Targets
+from sim import FakeMPVServer
+from sim.devices import FakeRadar
+
+
+# Benchmarks of controller hot paths. Results are flat dict of metrics;
+# metric name suffix tells whether higher ('_per_s') or lower ('_ms',
+# '_us') value is better, so results can be compared with baseline.
+
+RADAR_N_FRAMES = 20000
+MPV_N_ROUNDTRIPS = 2000
+MPV_N_BATCHES = 1000
+MPV_BATCH_SIZE = 20
+AUDIO_N_FILES = 50
+AUDIO_N_MARKS = 200
+AUDIO_N_REPEATS = 20
+TICK_DURATION = 5
+
+# Relative change treated as regression. Changes of timings smaller than
+# MIN_DELTA (in metric unit) are ignored as noise, max values are not
+# compared at all.
+TOLERANCE = 0.2
+MIN_DELTA = {"_ms": 1.0, "_us": 50.0, "overruns_per_s": 1.0}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    i = min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))
+    return values[i]
+
+def timing_stats(prefix, durations, unit="ms"):
+    scale = 1000 if unit == "ms" else 1000000
+    return {
+        f"{prefix}.mean_{unit}": statistics.mean(durations) * scale,
+        f"{prefix}.p50_{unit}": percentile(durations, 50) * scale,
+        f"{prefix}.p99_{unit}": percentile(durations, 99) * scale,
+        f"{prefix}.max_{unit}": max(durations) * scale,
+    }
+
+def write_capture(path, n_frames):
+    # Synthetic frames of simulated radar, 10 frames per second.
+
+    radar = FakeRadar()
+    writer = CaptureWriter(path)
+    for i in range(n_frames):
+        t = i / 10
+        writer.write(t, radar._frame(t))
+    writer.close()
+    radar.close()
+
+def bench_radar(tmp_dpath):
+    capture_path = tmp_dpath / "radar.cap"
+    write_capture(capture_path, RADAR_N_FRAMES)
+
+    results = {}
+
+    r = LD2450Replay(capture_path, speed=None)
+    t_start = time.perf_counter()
+    while not r._ser.done:
+        frame = r.get_frame()
+        if frame is not None:
+            r.parse_frame(frame)
+    elapsed = time.perf_counter() - t_start
+    results["radar.get_frame_parse_frame.frames_per_s"] = r.n_frames / elapsed
+
+    r = LD2450Replay(capture_path, speed=None)
+    targets = Targets()
+    t_start = time.perf_counter()
+    while not r._ser.done:
+        r.get_targets(targets)
+    elapsed = time.perf_counter() - t_start
+    results["radar.get_targets.frames_per_s"] = r.n_frames / elapsed
+
+    # Stream decoding (async runtime), 1 KiB chunks.
+    data = capture_path.read_bytes()
+    stream = b"".join(
+        data[i+8:i+RECORD.size]
+        for i in range(HEADER.size, len(data), RECORD.size))
+    r = LD2450Replay(capture_path, speed=None)
+    view = memoryview(stream)
+    t_start = time.perf_counter()
+    for i in range(0, len(stream), 1024):
+        frame = r.feed(view[i:i+1024])
+        if frame is not None:
+            r.decode_targets(frame, targets)
+    elapsed = time.perf_counter() - t_start
+    results["radar.feed.bytes_per_s"] = len(stream) / elapsed
+
+    return results
+
+def bench_mpv(tmp_dpath):
+    socket_path = tmp_dpath / "mpvsocket"
+    server = FakeMPVServer(socket_path)
+    server.start()
+
+    results = {}
+    try:
+        mpv = MPVClient(socket_path)
+
+        durations = []
+        for i in range(MPV_N_ROUNDTRIPS):
+            t_start = time.perf_counter()
+            mpv.get_property("pause")
+            durations.append(time.perf_counter() - t_start)
+        results.update(timing_stats("mpv.roundtrip", durations, "us"))
+
+        # Batches like in controller tick; responses to fire-and-forget
+        # commands are drained between batches.
+        t_start = time.perf_counter()
+        for i in range(MPV_N_BATCHES):
+            with mpv.batch():
+                for j in range(MPV_BATCH_SIZE):
+                    mpv.set_property("brightness", j, wait=False)
+            mpv.poll_events()
+        mpv.get_property("pause")
+        elapsed = time.perf_counter() - t_start
+        results["mpv.batch.commands_per_s"] = \
+            MPV_N_BATCHES * MPV_BATCH_SIZE / elapsed
+
+        mpv.close()
+    finally:
+        server.stop()
+
+    return results
+
+def bench_audio(tmp_dpath):
+    media_dpath = tmp_dpath / "audio"
+    media_dpath.mkdir()
+
+    for i in range(AUDIO_N_FILES):
+        path = media_dpath / f"{i:03}.wav"
+        path.write_bytes(b"")
+        with path.with_suffix(".csv").open("w") as f:
+            for j in range(AUDIO_N_MARKS):
+                f.write(f"{j * 0.5:.2f},{j % 10}\n")
+
+    results = {}
+
+    durations = []
+    for i in range(AUDIO_N_REPEATS):
+        t_start = time.perf_counter()
+        audio.get_files(media_dpath)
+        durations.append(time.perf_counter() - t_start)
+    results.update(timing_stats("audio.get_files", durations, "us"))
+
+    files = audio.get_files(media_dpath)
+    durations = []
+    for i in range(AUDIO_N_REPEATS):
+        t_start = time.perf_counter()
+        for f in files:
+            audio.load_marks(f)
+        durations.append((time.perf_counter() - t_start) / len(files))
+    results.update(timing_stats("audio.load_marks", durations, "us"))
+
+    catalog = audio.MediaCatalog(media_dpath)
+    durations = []
+    for i in range(AUDIO_N_REPEATS):
+        t_start = time.perf_counter()
+        catalog.get_files()
+        durations.append(time.perf_counter() - t_start)
+    results.update(timing_stats("audio.catalog_get_files", durations, "us"))
+
+    return results
+
+def bench_tick(tmp_dpath, cfg_dpath):
+    # Runs controller on simulated hardware for TICK_DURATION seconds and
+    # measures duration of every process() call (tick).
+    #
+    # Radar frames are replayed from capture in real time and polled by
+    # scheduled radar task, so ticks never wait for radar I/O and measure
+    # processing time only.
+
+    base_dpath = tmp_dpath / cfg_dpath.name
+    base_dpath.mkdir()
+
+    cfg = json.loads((cfg_dpath / "conf.cfg").read_text())
+    cfg['sim'] = {"mpv_socket": str(tmp_dpath / f"mpvsocket.{cfg_dpath.name}")}
+    if "radar" in cfg:
+        write_capture(base_dpath / "radar.cap", (TICK_DURATION + 5) * 10)
+        cfg['radar'].update(
+            {"replay": "radar.cap", "replay_speed": 1, "threaded": False})
+    (base_dpath / "conf.cfg").write_text(json.dumps(cfg))
+    if (cfg_dpath / "media").is_dir():
+        shutil.copytree(cfg_dpath / "media", base_dpath / "media")
+
+    # Controller writes messages and status line to stdout.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        ctl = Controller(base_dpath)
+
+        durations = []
+        t_end = time.monotonic() + TICK_DURATION
+        while time.monotonic() < t_end:
+            ctl.t = time.monotonic()
+            ctl.dt = datetime.now()
+
+            t_start = time.perf_counter()
+            ctl.process()
+            durations.append(time.perf_counter() - t_start)
+
+            ctl.scheduler.sleep()
+
+        tasks = ctl.scheduler.tasks
+        ctl.sim.stop()
+        ctl.log_writer.close()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    prefix = f"tick.{cfg_dpath.name}"
+    results = timing_stats(prefix, durations, "ms")
+    results[f"{prefix}.overruns_per_s"] = \
+        sum(t.n_overruns for t in tasks) / TICK_DURATION
+    for t in tasks:
+        results[f"{prefix}.{t.name}.duration_max_ms"] = t.duration_max * 1000
+    return results
+
+def run(configs_dpath):
+    results = {}
+    errors = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dpath = Path(tmp)
+
+        for name, func in [("radar", bench_radar), ("mpv", bench_mpv),
+                           ("audio", bench_audio)]:
+            print(f"Running '{name}' benchmark", file=sys.stderr)
+            results.update(func(tmp_dpath))
+
+        for cfg_dpath in sorted(Path(configs_dpath).iterdir()):
+            if not (cfg_dpath / "conf.cfg").is_file():
+                continue
+
+            print(f"Running tick benchmark of '{cfg_dpath.name}'", file=sys.stderr)
+            try:
+                results.update(bench_tick(tmp_dpath, cfg_dpath))
+            except (Exception, SystemExit) as e:
+                errors[cfg_dpath.name] = f"{type(e).__name__}: {e}"
+
+    return {
+        "meta": {
+            "datetime": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "node": platform.node(),
+        },
+        "results": results,
+        "errors": errors,
+    }
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    # Returns list of (metric, baseline value, value, relative change) of
+    # metrics worse than baseline by more than tolerance. Lower is better,
+    # except rates ('_per_s') of non-overrun metrics.
+
+    regressions = []
+    for name, base in baseline['results'].items():
+        value = results['results'].get(name)
+        if (value is None) or (base == 0) or ("max_" in name):
+            continue
+
+        min_delta = 0
+        for suffix, delta in MIN_DELTA.items():
+            if name.endswith(suffix):
+                min_delta = delta
+
+        if abs(value - base) < min_delta:
+            continue
+
+        change = (value - base) / abs(base)
+        higher_is_better = name.endswith("_per_s") and \
+            not name.endswith("overruns_per_s")
+        if higher_is_better:
+            change = -change
+
+        if change > tolerance:
+            regressions.append((name, base, value, change))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    try:
+        output_path = Path(sys.argv[1])
+    except:
+        print("\nUsage: bench.py <results.json> [baseline.json]\n"
+              "- results are written to results.json\n"
+              "- if baseline is given, results are compared with it and\n"
+              "  exit code is 1 in case of regressions\n")
+        sys.exit(1)
+
+    try:
+        baseline_path = Path(sys.argv[2])
+    except:
+        baseline_path = None
+
+    configs_dpath = Path(__file__).resolve().parent.parent / "configs"
+
+    results = run(configs_dpath)
+    output_path.write_text(json.dumps(results, indent=4))
+
+    for name, value in results['results'].items():
+        print(f"{name:>55}: {value:14.3f}")
+
+    for name, error in results['errors'].items():
+        print(f"Tick benchmark of '{name}' failed: {error}")
+
+    if baseline_path is None:
+        sys.exit(0)
+
+    baseline = json.loads(baseline_path.read_text())
+    regressions = compare(results, baseline)
+    if not regressions:
+        print(f"\nNo regressions against '{baseline_path}'")
+        sys.exit(0)
+
+    print(f"\nRegressions against '{baseline_path}' (tolerance: {TOLERANCE:.0%}):")
+    for name, base, value, change in regressions:
+        print(f"{name:>55}: {base:14.3f} -> {value:14.3f} ({change:+.0%})")
+    sys.exit(1)
@@ -1,32 +1,109 @@
 from datetime import datetime, timedelta
+import logging
 import math
 from pathlib import Path
 import random
 import time
 import sys
 
-import serial
-
 import audio
-from hand import Hand
+from actuator import ActuatorChannel
+import log_writer
+import metrics
 from mpv_client import MPVClient
-from radar_ld2450 import LD2450
-from rpi_hardware_pwm import HardwarePWM
+from radar_capture import LD2450Replay
+from radar_ld2450 import LD2450, Targets
+from scheduler import Scheduler
+from tracker import Tracker
 import utils
 
 
 class Controller():
-    def __init__(self, base_dpath):
+    # Default tick rates (Hz) of subsystems. Can be overridden with 'rate'
+    # key in corresponding config section.
+    RATES = {
+        "radar": 10,
+        "brightness": 10,
+        "overlay": 20,
+        "audio": 10,
+        "flower": 10,
+        "baby": 10,
+        "horse": 10,
+        "hand": 20,
+    }
+
+    # Overlay blink keyframes, one step per blink speed interval.
+    OVERLAY_BLINK_KEYFRAMES = [
+        [('halfhalflids', 400)],
+        [('halflids', 400)],
+        [('fulllids', 400)],
+        [('eye', None), ('fulllids', -2000)],
+        [('halflids', -2000)],
+        [('halfhalflids', -2000)],
+    ]
+
+    # Scheduled radar poll does not wait for frames; radar is treated as
+    # failed when no frame arrives for this long (seconds).
+    RADAR_FRAME_TIMEOUT = 1
+
+    # Default max number of commands per second written to serial actuators.
+    ACTUATOR_CMD_RATE = 20
+
+    # Config keys requiring re-initialization of subsystem hardware when
+    # changed. Other keys are applied in place on config reload.
+    HARDWARE_KEYS = {
+        "radar": ["uartdev", "threaded", "replay", "replay_speed", "record"],
+        "video": [],
+        "brightness": ["drm"],
+        "overlay": [],
+        "audio": ["device", "backend", "cache_mb"],
+        "flower": [],
+        "baby": ["uartdev", "cmd_rate"],
+        "horse": ["uartdev", "cmd_rate"],
+        "hand": ["inverted"],
+    }
+
+    OSD_RATE = 10
+    STATUS_RATE = 2
+    REPORT_PERIOD = 60
+    CONFIG_CHECK_PERIOD = 1
+
+    def __init__(self, base_dpath, sim=False):
         self.base_dpath = Path(base_dpath)
         self.cfg_path = self.base_dpath / "conf.cfg"
         self.error_log = self.base_dpath / "controller_error.log"
+        self.radar_config_cache = self.base_dpath / "radar_config.json"
+
+        self.t = time.monotonic()
+        self.dt = datetime.now()
 
         self.configure()
+        self.init_logging()
+        self.init_sim(sim)
         self.init_modules()
+        self.init_scheduler()
+        self.init_metrics()
 
         self.cfg_mtime = self.cfg_path.stat().st_mtime
 
     def __del__(self):
+        try:
+            self.log_writer.close()
+        except:
+            pass
+
+        try:
+            if self.flag_radar:
+                self.radar.close()
+        except:
+            pass
+
+        try:
+            if self.flag_audio:
+                self.audio_catalog.close()
+        except:
+            pass
+
         try:
             if self.flag_flower:
                 self.flower.stop()
@@ -45,9 +122,8 @@ class Controller():
         except:
             pass
 
-    def log(self, text):
-        with self.error_log.open("a") as f:
-            f.write(f"{text}\n")
+    def log(self, text, level=logging.ERROR):
+        self.logger.log(level, text)
 
     def configure(self):
         self.cfg = utils.load_json(self.cfg_path)
@@ -72,6 +148,39 @@ class Controller():
 
         self.flag_hand = "hand" in self.cfg
 
+    def init_logging(self):
+        # Messages of controller and modules (module loggers propagate to
+        # root logger) and status line are written by background thread
+        # (see log_writer). Optional top-level 'log' config section:
+        # - status_rate: status line rate, Hz (default STATUS_RATE)
+        # - queue_size: max number of pending records, newer are dropped
+        # - error_log_max_bytes, error_log_backups: error log rotation
+
+        cfg = self.cfg.get('log', {})
+
+        self.log_writer = log_writer.LogWriter(
+            None, self.error_log,
+            cfg.get('queue_size', log_writer.LogWriter.QUEUE_SIZE),
+            cfg.get('error_log_max_bytes', log_writer.LogWriter.ERROR_LOG_MAX_BYTES),
+            cfg.get('error_log_backups', log_writer.LogWriter.ERROR_LOG_BACKUP_COUNT))
+
+        self.logger = logging.getLogger("controller")
+        self.status_logger = logging.getLogger(log_writer.STATUS_LOGGER)
+
+    def get_status_rate(self):
+        return self.cfg.get('log', {}).get('status_rate', self.STATUS_RATE)
+
+    def init_sim(self, sim):
+        # Hardware is simulated if requested by CLI or by 'sim' config
+        # section (see sim.Simulation).
+
+        if sim or ("sim" in self.cfg):
+            from sim import Simulation
+            self.sim = Simulation(self.cfg.get('sim'))
+            self.logger.info("Simulation initialized")
+        else:
+            self.sim = None
+
     def init_modules(self):
         if self.flag_radar:
             self.init_radar()
@@ -94,21 +203,176 @@ class Controller():
         if self.flag_hand:
             self.init_hand()
 
-    def init_radar(self):
+    @staticmethod
+    def get_section(cfg, name):
+        # Returns config section of subsystem (None if it is disabled).
+        # Nested sections (brightness and overlay of video) are excluded.
+
+        if name in ["brightness", "overlay"]:
+            section = cfg.get('video', {}).get(name)
+        else:
+            section = cfg.get(name)
+
+        if section is None:
+            return
+
+        return {k: v for (k, v) in section.items() if not isinstance(v, dict)}
+
+    def get_rate(self, name):
+        return self.get_section(self.cfg, name).get('rate', self.RATES[name])
+
+    def init_scheduler(self):
+        self.scheduler = Scheduler()
+
+        for name in self.RATES:
+            if self.get_section(self.cfg, name) is not None:
+                self.scheduler.add(name, self.get_rate(name),
+                                   getattr(self, f"process_{name}"))
+
+        if self.flag_video:
+            self.scheduler.add("osd", self.OSD_RATE, self.process_osd)
+
+        self.scheduler.add("config", 1 / self.CONFIG_CHECK_PERIOD, self.check_config)
+        self.scheduler.add("status", self.get_status_rate(), self.print_status)
+        task = self.scheduler.add("report", 1 / self.REPORT_PERIOD, self.print_report)
+        task.deadline = self.t + self.REPORT_PERIOD
+
+    def init_metrics(self):
+        # Prometheus metrics endpoint is enabled by top-level 'metrics'
+        # config section: 'port' (and optional 'host', default 127.0.0.1)
+        # for TCP or 'socket' for UNIX socket.
+
+        self.metrics_server = None
+
+        cfg = self.cfg.get('metrics')
+        if cfg is None:
+            return
+
+        registry = metrics.Registry()
+
+        for task in self.scheduler.tasks:
+            task.histogram = registry.histogram(
+                "controller_task_duration_seconds",
+                "Duration of controller task runs.",
+                {"task": task.name})
+
+        if self.flag_video:
+            self.mpv.latency_histogram = registry.histogram(
+                "mpv_request_latency_seconds",
+                "Latency of MPV IPC requests waiting for response.")
+
+        registry.add_collector(self.collect_metrics)
+
+        self.metrics_server = metrics.MetricsServer(
+            registry, cfg.get('host', "127.0.0.1"), cfg.get('port'),
+            cfg.get('socket'))
+
+        self.logger.info(f"Metrics initialized ({self.metrics_server.address})")
+
+    def collect_metrics(self):
+        # Called on scrape only, so counters kept by subsystems cost nothing
+        # while nobody is scraping.
+
+        result = []
+
+        def add(cls, name, help_text, value, labels=None):
+            metric = cls(name, help_text, labels)
+            metric.value = value
+            result.append(metric)
+
+        for task in self.scheduler.tasks:
+            add(metrics.Counter, "controller_task_overruns_total",
+                "Task runs which missed the next deadline.",
+                task.n_overruns_total, {"task": task.name})
+
+        add(metrics.Counter, "controller_log_dropped_total",
+            "Log records dropped due to full queue.", self.log_writer.n_dropped)
+
+        if self.flag_radar:
+            r = self.radar
+            add(metrics.Counter, "radar_frames_total",
+                "Radar frames decoded.", r.n_frames)
+            add(metrics.Counter, "radar_skipped_bytes_total",
+                "Radar bytes skipped by decoder.", r.n_skipped_bytes)
+            add(metrics.Counter, "radar_invalid_headers_total",
+                "Radar frames with invalid header or EOF.", r.n_invalid_headers)
+            add(metrics.Counter, "radar_buffer_overflows_total",
+                "Radar reads limited by full decoder buffer.", r.n_overflows)
+            add(metrics.Counter, "radar_dropped_frames_total",
+                "Radar frames of reader thread never consumed.", r.n_dropped_frames)
+
+        if self.flag_video:
+            add(metrics.Counter, "mpv_requests_total",
+                "MPV IPC requests waiting for response.", self.mpv.n_requests)
+            add(metrics.Counter, "mpv_request_failures_total",
+                "MPV IPC requests timed out or rejected.", self.mpv.n_failures)
+
+        for name, flag in [("baby", self.flag_baby), ("horse", self.flag_horse)]:
+            if not flag:
+                continue
+
+            channel = getattr(self, name)
+            labels = {"actuator": name}
+            add(metrics.Gauge, "actuator_queue_depth",
+                "Actuator commands waiting to be written.",
+                channel.queue_depth, labels)
+            add(metrics.Counter, "actuator_commands_written_total",
+                "Actuator commands written to serial.", channel.n_written, labels)
+            add(metrics.Counter, "actuator_commands_coalesced_total",
+                "Actuator position commands replaced before written.",
+                channel.n_coalesced, labels)
+            add(metrics.Counter, "actuator_write_failures_total",
+                "Actuator serial write failures.", channel.n_failures, labels)
+
+        return result
+
+    def configure_radar(self):
         cfg = self.cfg['radar']
         self.RADAR_UARTDEV = cfg['uartdev']
         self.RADAR_DISTANCE_MIN = cfg['distance_min']
         self.RADAR_DISTANCE_MAX = cfg['distance_max']
         self.RADAR_DISTANCE_DELTA = cfg['distance_delta']
         self.RADAR_DISTANCE_ACTION = cfg['distance_action']
+        self.RADAR_THREADED = cfg.get('threaded', False)
+
+        # Frames may be replayed from capture file instead of UART device
+        # (replay_speed null - as fast as possible) or recorded to one.
+        self.RADAR_REPLAY = cfg.get('replay')
+        self.RADAR_REPLAY_SPEED = cfg.get('replay_speed', 1)
+        self.RADAR_RECORD = cfg.get('record')
 
-        r = LD2450(self.RADAR_UARTDEV)
-        r.set_bluetooth_off(restart=True)
-        r.set_multi_tracking()
-        r.set_zone_filtering(mode=0)
+        # Tracking smooths targets across frames; position of the primary
+        # target is predicted 'tracking_lead' seconds ahead to compensate
+        # latency of actuators.
+        self.RADAR_TRACKING = cfg.get('tracking', False)
+        self.RADAR_TRACKING_LEAD = cfg.get('tracking_lead', 0)
+
+    def init_radar(self):
+        self.configure_radar()
+
+        if self.RADAR_REPLAY is None:
+            if self.sim is None:
+                r = LD2450(self.RADAR_UARTDEV)
+            else:
+                r = LD2450(self.sim.get_radar_uartdev())
+        else:
+            r = LD2450Replay(self.base_dpath / self.RADAR_REPLAY,
+                             speed=self.RADAR_REPLAY_SPEED)
+        cache_path = self.radar_config_cache if self.sim is None else None
+        r.ensure_config(bluetooth=False, multi_tracking=True, zone_filtering=0,
+                        cache_path=cache_path)
+        if self.RADAR_RECORD is not None:
+            r.start_recording(self.base_dpath / self.RADAR_RECORD)
+        if self.RADAR_THREADED:
+            r.start_reader()
         self.radar = r
 
+        self.radar_targets = Targets()
+        self.radar_tracker = Tracker()
+        self.radar_track = None
         self.radar_n_failures = 0
+        self.radar_last_frame_t = time.monotonic()
+        self.radar_seq = 0
         self.radar_distance = None
         self.radar_angle = None
         self.radar_human_present = False
@@ -116,28 +380,57 @@ class Controller():
         self.radar_distance_reliable = self.RADAR_DISTANCE_MAX
         self.radar_distance_action = False
 
-        print("Radar initialized")
+        self.logger.info("Radar initialized")
 
     def process_radar(self):
-        data = self.radar.get_data()
-        if data is None:
-            self.radar_n_failures += 1
-            if self.radar_n_failures < 5:
-                return False
-
-            text = f"{self.dt}: exiting due to {self.radar_n_failures} consequent radar failures"
-            print(text)
-            self.log(text)
+        targets = self.radar_targets
+        if self.RADAR_THREADED:
+            seq = self.radar.get_latest(targets)
+            self.radar_n_failures = self.radar.reader_n_failures
+            ok = seq != self.radar_seq
+        else:
+            # Unthrottled replay releases frames only by read, so it is
+            # read in blocking mode (it never waits).
+            block = (self.RADAR_REPLAY is not None) and (self.RADAR_REPLAY_SPEED is None)
+            ok = self.radar.get_targets(targets, block)
+            if ok:
+                self.radar_n_failures = 0
+                self.radar_last_frame_t = self.t
+            elif self.t - self.radar_last_frame_t >= self.RADAR_FRAME_TIMEOUT:
+                self.radar_n_failures += 1
+                self.radar_last_frame_t = self.t
+
+        if self.radar_n_failures >= 5:
+            self.log(f"exiting due to {self.radar_n_failures} consequent radar failures")
+
+            # Radar may have lost its configuration (e.g. after power loss),
+            # so it is read and applied again on the next start.
+            self.radar.invalidate_config_cache(self.radar_config_cache)
             sys.exit(1)
 
-        self.radar_n_failures = 0
+        if ok:
+            self.update_radar(targets)
+            if self.RADAR_THREADED:
+                self.radar_seq = seq
+        elif not self.RADAR_THREADED:
+            return False
 
-        distance_angle_list = list(
-            map(lambda t: (self.radar.distance(t), self.radar.angle(t)), data))
+        return True
 
-        if distance_angle_list:
-            self.radar_distance, self.radar_angle = \
-                min(distance_angle_list, key=lambda t: t[0])
+    def update_radar(self, targets):
+        if self.RADAR_TRACKING:
+            self.radar_track = self.radar_tracker.update(targets, self.t)
+        else:
+            self.radar_track = None
+
+        if self.radar_track is not None:
+            x, y = self.radar_track.predict(self.RADAR_TRACKING_LEAD)
+            self.radar_distance = math.hypot(x, y)
+            self.radar_angle = math.atan2(x, y)
+        elif (not self.RADAR_TRACKING) and (targets.nearest >= 0):
+            i = targets.nearest
+            self.radar_distance = targets.distance[i]
+            self.radar_angle = targets.angle[i]
         else:
             self.radar_distance = None
             self.radar_angle = None
@@ -166,26 +459,20 @@ class Controller():
         else:
             self.radar_distance_action = False
 
-        if self.flag_video and self.video_osd_state:
-            if self.radar_distance:
-                self.video_osd_text += f"Distance: {self.radar_distance:6.0f}\n"
-            else:
-                self.video_osd_text += f"Distance:   ---  \n"
-
-            self.video_osd_text += f"Distance reliable: {self.radar_distance_reliable:6.0f}\n"
-
-        return True
-
-    def init_video(self):
+    def configure_video(self):
         cfg = self.cfg['video']
         self.VIDEO_OSD = cfg['osd']
 
+    def init_video(self):
+        self.configure_video()
+
         try:
-            self.mpv = MPVClient()
+            if self.sim is None:
+                self.mpv = MPVClient()
+            else:
+                self.mpv = MPVClient(self.sim.get_mpv_socket())
         except Exception as e:
-            text = f"{datetime.now()}: {e}"
-            print(text)
-            self.log(text)
+            self.log(str(e))
             sys.exit(1)
 
         self.video_osd_state = self.VIDEO_OSD
@@ -196,30 +483,57 @@ class Controller():
         if self.flag_video_overlay:
             self.init_overlay()
 
-    def process_video(self):
+    def process_osd(self):
+        if not self.video_osd_state:
+            return
+
+        text = ""
+
+        if self.flag_radar:
+            if self.radar_distance:
+                text += f"Distance: {self.radar_distance:6.0f}\n"
+            else:
+                text += f"Distance:   ---  \n"
+
+            text += f"Distance reliable: {self.radar_distance_reliable:6.0f}\n"
+
         if self.flag_video_brightness:
-            self.process_brightness()
+            text += f"Brightness: {self.brightness:6}\n"
 
         if self.flag_video_overlay:
-            self.process_overlay()
+            text += f"Overlay X: {self.overlay_x}\n"
 
-    def init_brightness(self):
+        if self.flag_audio:
+            text += f"Audio state: {self.audio_state}\n"
+            if self.audio_state == 1:
+                text += f"Audio file: {self.audio_file.name[:20]}\n"
+
+        self.mpv.show_text(text, wait=False)
+
+    def configure_brightness(self):
         cfg = self.cfg['video']['brightness']
         self.BRIGHTNESS_MIN = cfg['min']
         self.BRIGHTNESS_MAX = cfg['max']
         self.BRIGHTNESS_DELTA = cfg['delta']
         self.BRIGHTNESS_DRM = cfg['drm']
 
+    def init_brightness(self):
+        self.configure_brightness()
+
         self.brightness = self.BRIGHTNESS_MIN
         self.brightness_do_not_change_until_dt = datetime.now()
-        self.brightness_next_time_check_dt = datetime.now()
+
+        # Remaining time is pushed by MPV, so reading it costs no IPC.
+        if not self.mpv.observe_property("time-remaining"):
+            self.log("failed to observe property 'time-remaining' of MPV")
+            sys.exit(1)
 
         if self.BRIGHTNESS_DRM:
             self.mpv.set_drm_brightness(self.brightness)
         else:
             self.mpv.set_brightness(self.brightness)
 
-        print("Video brightness initialized")
+        self.logger.info("Video brightness initialized")
 
     def process_brightness(self):
         if self.dt < self.brightness_do_not_change_until_dt:
@@ -227,18 +541,11 @@ class Controller():
             return
 
         self.video_osd_state = self.VIDEO_OSD
-        if self.video_osd_state:
-            self.video_osd_text += f"Brightness: {self.brightness:6}\n"
-
-        if self.dt > self.brightness_next_time_check_dt:
-            remaining_time = self.mpv.get_property("time-remaining")
-            if remaining_time is not None:
-                self.brightness_next_time_check_dt = self.dt + timedelta(seconds=1)
-                if remaining_time < 2:
-                    self.brightness_do_not_change_until_dt = self.dt + timedelta(seconds=3)
-                    return
-            else:
-                self.log(f"{self.dt}: failed to get property 'time-remaining' from MPV")
+
+        remaining_time = self.mpv.get_observed("time-remaining")
+        if (remaining_time is not None) and (remaining_time < 2):
+            self.brightness_do_not_change_until_dt = self.dt + timedelta(seconds=3)
+            return
 
         if self.radar_human_present:
             br_new = utils.linear_map(
@@ -266,11 +573,11 @@ class Controller():
 
         if br_diff != 0:
             if self.BRIGHTNESS_DRM:
-                self.mpv.set_drm_brightness(self.brightness)
+                self.mpv.set_drm_brightness(self.brightness, wait=False)
             else:
-                self.mpv.set_brightness(self.brightness)
+                self.mpv.set_brightness(self.brightness, wait=False)
 
-    def init_overlay(self):
+    def configure_overlay(self):
         cfg = self.cfg['video']['overlay']
         self.OVERLAY_X_MIN = cfg['x_min']
         self.OVERLAY_X_MAX = cfg['x_max']
@@ -278,18 +585,20 @@ class Controller():
         self.OVERLAY_BLINK_PAUSE_MIN = cfg['blink_pause_min']
         self.OVERLAY_BLINK_PAUSE_MAX = cfg['blink_pause_max']
 
+    def init_overlay(self):
+        self.configure_overlay()
+
         self.overlay_x = (self.OVERLAY_X_MIN + self.OVERLAY_X_MAX) // 2
         self.overlay_blink = False
         self.overlay_blink_speed = None
+        self.overlay_blink_step = None
+        self.overlay_blink_step_t = None
         self.overlay_next_blink_dt = datetime.now()
 
-        print("Video overlay initialized")
+        self.logger.info("Video overlay initialized")
 
     def process_overlay(self):
-        self.overlay_blink = False
-
-        if self.video_osd_state:
-            self.video_osd_text += f"Overlay X: {self.overlay_x}\n"
+        blink = False
 
         if self.radar_human_present:
             x_new = utils.linear_map(
@@ -299,83 +608,93 @@ class Controller():
             x_new = int(x_new)
 
             if abs(x_new - self.overlay_x) > self.OVERLAY_BLINK_X_THRESHOLD:
-                self.overlay_blink = True
+                blink = True
 
             self.overlay_x = x_new
 
         if self.dt > self.overlay_next_blink_dt:
+            blink = True
+
+        if blink and not self.overlay_blink:
             self.overlay_blink = True
             self.overlay_blink_speed = utils.linear_map(
                 random.random(), 0, 1, 0.05, 0.2)
+            self.overlay_blink_step = 0
+            self.overlay_blink_step_t = self.t
 
-        if self.overlay_blink:
-            self.mpv.set_x_overlay('halfhalflids', 400)
-            time.sleep(self.overlay_blink_speed)
-            self.mpv.set_x_overlay('halflids', 400)
-            time.sleep(self.overlay_blink_speed)
-            self.mpv.set_x_overlay('fulllids', 400)
-            time.sleep(self.overlay_blink_speed)
+        if not self.overlay_blink:
+            if self.radar_human_present:
+                self.mpv.set_x_overlay('eye', self.overlay_x, wait=False)
+            return
 
-        if self.radar_human_present:
-            self.mpv.set_x_overlay('eye', self.overlay_x)
+        # Blink advances at most one keyframe per tick, so it never blocks
+        # other subsystems.
+        if self.t < self.overlay_blink_step_t:
+            return
+
+        for name, x in self.OVERLAY_BLINK_KEYFRAMES[self.overlay_blink_step]:
+            if name == 'eye':
+                # Eye is moved while lids are closed.
+                if self.radar_human_present:
+                    self.mpv.set_x_overlay('eye', self.overlay_x, wait=False)
+            else:
+                self.mpv.set_x_overlay(name, x, wait=False)
+
+        self.overlay_blink_step += 1
+        self.overlay_blink_step_t += self.overlay_blink_speed
 
-        if self.overlay_blink:
-            self.mpv.set_x_overlay('fulllids', -2000)
-            time.sleep(self.overlay_blink_speed)
-            self.mpv.set_x_overlay('halflids', -2000)
-            time.sleep(self.overlay_blink_speed)
-            self.mpv.set_x_overlay('halfhalflids', -2000)
+        if self.overlay_blink_step == len(self.OVERLAY_BLINK_KEYFRAMES):
+            self.overlay_blink = False
+            self.overlay_blink_step = None
+            self.overlay_blink_step_t = None
 
             blink_delta = timedelta(seconds=random.randint(
                 self.OVERLAY_BLINK_PAUSE_MIN,
                 self.OVERLAY_BLINK_PAUSE_MAX))
             self.overlay_next_blink_dt = self.dt + blink_delta
 
-    def init_audio(self):
+    def configure_audio(self):
         cfg = self.cfg['audio']
         self.AUDIO_DEVICE = cfg['device']
+        self.AUDIO_BACKEND = cfg.get('backend', 'aplay')
+        self.AUDIO_CACHE_MB = cfg.get('cache_mb', 64)
         self.AUDIO_PAUSE_MIN = cfg['pause_min']
         self.AUDIO_PAUSE_MAX = cfg['pause_max']
 
+    def init_audio(self):
+        self.configure_audio()
+
+        self.audio_cache = audio.WavCache(self.AUDIO_CACHE_MB * 2**20)
+        self.audio_catalog = audio.MediaCatalog(
+            self.base_dpath / "media" / "audio", cache=self.audio_cache)
+
         audio.killall()
         self.audio_state = 0
-        self.audio_state_prev = 0
         self.audio_files = None
         self.audio_file = None
         self.audio_proc = None
-        self.audio_start_dt = None
         self.audio_pause_until_dt = None
 
-        print("Audio initialized")
+        self.logger.info("Audio initialized")
 
     def process_audio(self):
-        if self.flag_video and self.video_osd_state:
-           self.video_osd_text += f"Audio state: {self.audio_state}\n"
-           if self.audio_state == 1:
-               self.video_osd_text += f"Audio file: {self.audio_file.name[:20]}\n"
-
-        self.audio_state_prev = self.audio_state
-
         if self.audio_state == 0: # not playing
             self.audio_files = None
 
             if self.radar_distance_action:
-                self.audio_files = audio.get_files(self.base_dpath / "media" / "audio")
+                self.audio_files = self.audio_catalog.get_files()
                 if len(self.audio_files) > 0:
                     random.shuffle(self.audio_files)
 
                     self.audio_file = self.audio_files.pop(0)
-                    self.audio_proc = audio.play(self.AUDIO_DEVICE, self.audio_file)
-                    self.audio_start_dt = self.dt
+                    self.audio_proc = audio.play(self.AUDIO_DEVICE, self.audio_file,
+                                                 self.AUDIO_BACKEND, self.audio_cache)
                     self.audio_state = 1
 
         elif self.audio_state == 1: # playing audio file
             if self.audio_proc.poll() is not None:
                 if self.audio_proc.returncode != 0:
-                    text = f"{self.dt}: audio failed " \
-                           f"(return code {self.audio_proc.returncode})"
-                    print(text)
-                    self.log(text)
+                    self.log(f"audio failed (return code {self.audio_proc.returncode})")
                     
                     self.audio_state = 0
                 elif self.radar_distance_action:
@@ -394,8 +713,8 @@ class Controller():
             if self.radar_distance_action:
                 if self.dt > self.audio_pause_until_dt:
                     self.audio_file = self.audio_files.pop(0)
-                    self.audio_proc = audio.play(self.AUDIO_DEVICE, self.audio_file)
-                    self.audio_start_dt = self.dt
+                    self.audio_proc = audio.play(self.AUDIO_DEVICE, self.audio_file,
+                                                 self.AUDIO_BACKEND, self.audio_cache)
                     self.audio_state = 1
             else:
                 self.audio_state = 0
@@ -404,18 +723,26 @@ class Controller():
             if not self.radar_distance_action:
                 self.audio_state = 0
 
-    def init_flower(self):
+    def configure_flower(self):
         cfg = self.cfg['flower']
         self.FLOWER_DC_MIN = cfg['dc_min']
         self.FLOWER_DC_MAX = cfg['dc_max']
         self.FLOWER_DC_DELTA = cfg['dc_delta']
 
+    def init_flower(self):
+        self.configure_flower()
+
+        if self.sim is None:
+            from rpi_hardware_pwm import HardwarePWM
+        else:
+            from sim import HardwarePWM
+
         self.flower = HardwarePWM(channel=0, hz=50, chip=0)
         self.flower_dc = self.FLOWER_DC_MIN
         self.flower.start(self.flower_dc)
         self.flower_stopped = False
 
-        print("Flower initialized")
+        self.logger.info("Flower initialized")
 
     def process_flower(self):
         if self.radar_human_present:
@@ -445,19 +772,27 @@ class Controller():
                     self.flower.stop()
                     self.flower_stopped = True
 
-    def init_baby(self):
+    def configure_baby(self):
         cfg = self.cfg['baby']
         self.BABY_UARTDEV = cfg['uartdev']
         self.BABY_BLINK_PAUSE_MIN = cfg['blink_pause_min']
         self.BABY_BLINK_PAUSE_MAX = cfg['blink_pause_max']
         self.BABY_X_DELTA = cfg['x_delta']
+        self.BABY_CMD_RATE = cfg.get('cmd_rate', self.ACTUATOR_CMD_RATE)
 
-        self.baby = serial.Serial(self.BABY_UARTDEV, 9600, timeout=1)
+    def init_baby(self):
+        self.configure_baby()
+
+        uartdev = self.BABY_UARTDEV
+        if self.sim is not None:
+            uartdev = self.sim.get_actuator_uartdev("baby")
+
+        self.baby = ActuatorChannel(uartdev, 9600, self.BABY_CMD_RATE)
         self.baby_x = 120
         self.baby_blink = False
         self.baby_next_blink_dt = datetime.now()
 
-        print("Baby initialized")
+        self.logger.info("Baby initialized")
 
     def process_baby(self):
         if self.radar_human_present and self.radar_distance_action:
@@ -476,7 +811,7 @@ class Controller():
                 self.baby_x += x_diff
 
                 cmd = f"{self.baby_x}\n".encode()
-                self.baby.write(cmd)
+                self.baby.set_position(cmd)
 
             if self.dt > self.baby_next_blink_dt:
                 self.baby_blink = True
@@ -484,21 +819,29 @@ class Controller():
                 self.baby_blink = False
 
             if self.baby_blink:
-                self.baby.write(b"blink\n")
+                self.baby.send(b"blink\n")
 
                 blink_delta = timedelta(seconds=random.randint(self.BABY_BLINK_PAUSE_MIN,
                                                                self.BABY_BLINK_PAUSE_MAX))
                 self.baby_next_blink_dt = self.dt + blink_delta
 
-    def init_horse(self):
+    def configure_horse(self):
         cfg = self.cfg['horse']
         self.HORSE_UARTDEV = cfg['uartdev']
+        self.HORSE_CMD_RATE = cfg.get('cmd_rate', self.ACTUATOR_CMD_RATE)
+
+    def init_horse(self):
+        self.configure_horse()
+
+        uartdev = self.HORSE_UARTDEV
+        if self.sim is not None:
+            uartdev = self.sim.get_actuator_uartdev("horse")
 
-        self.horse = serial.Serial(self.HORSE_UARTDEV, 9600, timeout=1)
+        self.horse = ActuatorChannel(uartdev, 9600, self.HORSE_CMD_RATE)
         self.horse_state = 0
         self.horse_next_time_check_dt = datetime.now()
 
-        print("Horse initialized")
+        self.logger.info("Horse initialized")
 
     def process_horse(self):
         if self.dt < self.horse_next_time_check_dt:
@@ -508,7 +851,7 @@ class Controller():
             if self.radar_distance_reliable < 1000:
                 n = utils.linear_map(
                     random.random(), 0, 1, 20, 100)
-                self.horse.write(f"trot {n}\n".encode())
+                self.horse.send(f"trot {n}\n".encode())
 
                 self.horse_next_time_check_dt = self.dt + timedelta(seconds=10)
                 self.horse_state = 1
@@ -517,92 +860,76 @@ class Controller():
             if self.radar_distance_reliable > 1500:
                 self.horse_state = 0
 
-    def init_hand(self):
+    def configure_hand(self):
         cfg = self.cfg['hand']
         self.HAND_INVERTED = cfg['inverted']
 
+    def init_hand(self):
+        self.configure_hand()
+
+        if self.sim is None:
+            from hand import Hand
+        else:
+            from sim import Hand
+
         self.hand = Hand(inverted=self.HAND_INVERTED)
         self.hand_stop_dt = datetime.now() + timedelta(seconds=1)
 
-        self.hand_audio_marks = None
-        self.hand_audio_current_mark_dt = None
+        self.hand_audio_state = 0
+        self.hand_audio_timeline = None
         self.hand_audio_current_mark_position = None
-        self.hand_audio_next_mark_dt = None
-        self.hand_audio_next_mark_position = None
 
-        print("Hand initialized")
+        self.logger.info("Hand initialized")
 
     def process_hand(self):
         if (self.hand_stop_dt is not None) and (self.dt > self.hand_stop_dt):
             self.hand.stop()
             self.hand_stop_dt = None
 
+        # Audio state of the previous hand tick is tracked here, since audio
+        # and hand are processed at independent rates.
+        audio_state_prev = self.hand_audio_state
+        self.hand_audio_state = self.audio_state
+
         if (self.audio_state in [0,2,3]) and \
-           (self.audio_state_prev == 1):
+           (audio_state_prev == 1):
             #self.hand.set_position_by_name("close")
             self.hand_stop_dt = self.dt + timedelta(seconds=1)
 
-            self.hand_audio_marks = None
-            self.hand_audio_current_mark_dt = None
+            self.hand_audio_timeline = None
             self.hand_audio_current_mark_position = None
-            self.hand_audio_next_mark_dt = None
-            self.hand_audio_next_mark_position = None
 
         elif self.audio_state == 1: # playing
-            if self.hand_audio_marks is None:
-                try:
-                    self.hand_audio_marks = audio.load_marks(self.audio_file)
-                except:
+            if self.hand_audio_timeline is None:
+                marks = self.audio_catalog.get_marks(self.audio_file)
+                if marks is None:
                     return
 
-                if len(self.hand_audio_marks) > 0:
-                    mark = self.hand_audio_marks.pop(0)
-                    self.hand_audio_next_mark_dt = \
-                        self.audio_start_dt + timedelta(seconds=mark[0])
-                    self.hand_audio_next_mark_position = mark[1]
+                self.hand_audio_timeline = audio.MarkTimeline(marks)
 
-            if self.hand_audio_next_mark_dt is None:
+            # Marks overtaken since the previous tick are coalesced into the
+            # newest one. Playback position comes from the audio player.
+            name = self.hand_audio_timeline.advance(self.audio_proc.position)
+            if name is None:
                 return
 
-            if self.dt > self.hand_audio_next_mark_dt:
-                self.hand_audio_current_mark_dt = self.hand_audio_next_mark_dt
-                self.hand_audio_current_mark_position = self.hand_audio_next_mark_position
+            self.hand_audio_current_mark_position = name
 
-                self.hand.set_position_by_name(self.hand_audio_current_mark_position)
-                self.hand_stop_dt = self.dt + timedelta(seconds=1)
-
-                if len(self.hand_audio_marks) == 0:
-                    self.hand_audio_next_mark_dt = None
-                    self.hand_audio_next_mark_position = None
-                else:
-                    mark = self.hand_audio_marks.pop(0)
-                    self.hand_audio_next_mark_dt = \
-                        self.audio_start_dt + timedelta(seconds=mark[0])
-                    self.hand_audio_next_mark_position = mark[1]
-
-    def process(self):
-        cfg_mtime = self.cfg_path.stat().st_mtime
-        if cfg_mtime != self.cfg_mtime:
-            text = "{self.dt}: exiting due to config file change"
-            print(text)
-            self.log(text)
-            sys.exit(1)
-
-        self.video_osd_text = ""
+            self.hand.set_position_by_name(name)
+            self.hand_stop_dt = self.dt + timedelta(seconds=1)
 
+    def print_status(self):
         text = f"{self.dt}"
 
         if self.flag_radar:
-            f = self.process_radar()
-            if not f:
-                return
-
-            text =  f" | IN: {self.radar.in_waiting:5}"
+            text += f" | IN: {self.radar.in_waiting:5}"
             if self.radar_human_present:
                 text += f" | Human: yes"
                 text += f" | Distance: {self.radar_distance:6.0f}"
                 text += f" | Distance reliable: {self.radar_distance_reliable:6.0f}"
                 text += f" | Angle: {self.radar_angle:7.2f}"
+                if self.radar_track is not None:
+                    text += f" | Track: {self.radar_track.id:4}"
             else:
                 text += f" | Human: no "
                 text +=  " | Distance:   --  "
@@ -610,13 +937,9 @@ class Controller():
                 text +=  " | Angle:   --  "
 
         if self.flag_video_brightness:
-            self.process_brightness()
-
             text += f" | Brightness: {self.brightness:7}"
 
         if self.flag_video_overlay:
-            self.process_overlay()
-
             text += f" | Overlay X: {self.overlay_x:5}"
             if self.overlay_blink:
                 text += f" | Overlay blink: yes"
@@ -624,46 +947,137 @@ class Controller():
                 text += f" | Overlay blink: no "
 
         if self.flag_audio:
-            self.process_audio()
-
             text += f" | Audio state: {self.audio_state:3}"
 
         if self.flag_flower:
-            self.process_flower()
-
             text += f" | Flower: {self.flower_dc:6.0f}"
 
         if self.flag_baby:
-            self.process_baby()
-
             text += f" | Baby X: {self.baby_x:7}"
             if self.baby_blink:
                 text += f" | Baby blink: yes"
             else:
                 text += f" | Baby blink: no "
+            text += f" | Baby queue: {self.baby.queue_depth:3}"
 
         if self.flag_horse:
-            self.process_horse()
-
             text += f" | Horse state: {self.horse_state:3}"
+            text += f" | Horse queue: {self.horse.queue_depth:3}"
 
         if self.flag_hand:
-            self.process_hand()
-
             if self.hand_audio_current_mark_position is None:
                 text += f" | Hand position:     ---    "
             else:
                 text += f" | Hand position: {self.hand_audio_current_mark_position:<10} "
 
-        if self.flag_video and self.video_osd_state:
-            self.mpv.show_text(self.video_osd_text)
+        self.status_logger.info(text)
+
+    def print_report(self):
+        self.logger.info(f"scheduler report\n{self.scheduler.report()}")
+
+    def check_config(self):
+        cfg_mtime = self.cfg_path.stat().st_mtime
+        if cfg_mtime == self.cfg_mtime:
+            return
+
+        self.cfg_mtime = cfg_mtime
+        self.reload_config()
+
+    def exit_on_config_change(self, reason):
+        self.log(f"exiting due to config file change ({reason})")
+        sys.exit(1)
+
+    def reinit_subsystem(self, name):
+        if name == "radar":
+            self.radar.close()
+            self.init_radar()
+        elif name == "brightness":
+            # Property 'time-remaining' is already observed, so only
+            # brightness control is switched.
+            self.configure_brightness()
+            if self.BRIGHTNESS_DRM:
+                self.mpv.set_drm_brightness(self.brightness)
+            else:
+                self.mpv.set_brightness(self.brightness)
+        elif name == "audio":
+            if (self.audio_state == 1) and (self.audio_proc.poll() is None):
+                self.audio_proc.stop()
+            self.audio_catalog.close()
+            self.init_audio()
+        elif name == "baby":
+            self.baby.close()
+            self.init_baby()
+        elif name == "horse":
+            self.horse.close()
+            self.init_horse()
+        elif name == "hand":
+            self.hand.stop()
+            self.init_hand()
+
+    def reload_config(self):
+        # Subsystems whose hardware keys changed are re-initialized, other
+        # changes (tunables and rates) are applied in place. Adding or
+        # removing subsystems still requires restart.
 
-        print(text)
+        try:
+            cfg = utils.load_json(self.cfg_path)
+        except Exception as e:
+            self.log(f"failed to reload config\n{e}")
+            return
+
+        cfg_old = self.cfg
+        for name in self.HARDWARE_KEYS:
+            if (self.get_section(cfg, name) is None) != \
+               (self.get_section(cfg_old, name) is None):
+                self.exit_on_config_change(f"subsystem '{name}' added or removed")
+
+        self.cfg = cfg
+
+        changes = []
+        try:
+            for name, hardware_keys in self.HARDWARE_KEYS.items():
+                section = self.get_section(cfg, name)
+                section_old = self.get_section(cfg_old, name)
+                if section == section_old:
+                    continue
+
+                keys = set(section) | set(section_old)
+                changed = [k for k in keys if section.get(k) != section_old.get(k)]
+
+                if set(changed) & set(hardware_keys):
+                    self.reinit_subsystem(name)
+                    changes.append(f"{name} (reinitialized)")
+                else:
+                    getattr(self, f"configure_{name}")()
+                    changes.append(f"{name} ({', '.join(sorted(changed))})")
+
+                task = self.scheduler.get(name)
+                if task is not None:
+                    task.set_rate(self.get_rate(name))
+        except Exception as e:
+            self.exit_on_config_change(f"failed to apply: {e}")
+
+        if self.get_status_rate() != self.scheduler.get("status").rate:
+            self.scheduler.get("status").set_rate(self.get_status_rate())
+            changes.append("status rate")
+
+        self.log(f"config reloaded: {'; '.join(changes)}", logging.WARNING)
+
+    def process(self):
+        if self.flag_video:
+            # Fire-and-forget mpv commands of all subsystems processed in
+            # this tick are sent together.
+            with self.mpv.batch():
+                self.scheduler.run_pending(self.t)
+        else:
+            self.scheduler.run_pending(self.t)
 
     def start(self):
         while True:
+            self.t = time.monotonic()
             self.dt = datetime.now()
             self.process()
+            self.scheduler.sleep()
 
 
 if __name__ == "__main__":
@@ -673,5 +1087,26 @@ if __name__ == "__main__":
         print("No argument for base directory path provided")
         sys.exit(1)
 
-    ctl = Controller(base_dpath)
+    args = sys.argv[2:]
+
+    # Simulated hardware (see sim package).
+    sim = "sim" in args
+    if sim:
+        args.remove("sim")
+
+    try:
+        runtime = args[0]
+    except:
+        runtime = "sync"
+
+    if runtime not in ["sync", "async"]:
+        print("Runtime argument must be 'sync' (default) or 'async'")
+        sys.exit(1)
+
+    if runtime == "async":
+        from controller_async import AsyncController
+        ctl = AsyncController(base_dpath, sim=sim)
+    else:
+        ctl = Controller(base_dpath, sim=sim)
+
     ctl.start()
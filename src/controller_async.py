@@ -0,0 +1,142 @@
+import asyncio
+from datetime import datetime
+import sys
+import time
+
+from controller import Controller
+from mpv_client import AsyncMPVClient
+
+
+class RadarProtocol(asyncio.Protocol):
+    def __init__(self, ctl):
+        self.ctl = ctl
+
+    def data_received(self, data):
+        self.ctl.on_radar_data(data)
+
+    def connection_lost(self, exc):
+        self.ctl.on_radar_lost(exc)
+
+
+class AsyncController(Controller):
+    # Runs every subsystem as its own asyncio task. Radar frames are decoded
+    # as soon as they arrive via serial transport and MPV commands go
+    # through asyncio streams, so slow I/O of one device does not delay the
+    # others. Serial actuators already write from their own threads (see
+    # ActuatorChannel).
+    #
+    # Modules are initialized synchronously (see Controller), then devices
+    # are switched to asyncio transports.
+
+    RADAR_TIMEOUT = 5
+    RADAR_REPLAY_POLL_PERIOD = 0.01
+
+    def start(self):
+        asyncio.run(self.run())
+
+    async def init_transports(self):
+        loop = asyncio.get_running_loop()
+
+        if self.flag_radar:
+            self.radar.stop_reader()
+            self.radar.clean()
+            if self.RADAR_REPLAY is None:
+                await loop.connect_read_pipe(
+                    lambda: RadarProtocol(self), self.radar._ser)
+            self.radar_last_frame_t = time.monotonic()
+
+        if self.flag_video:
+            mpv = await AsyncMPVClient.connect(self.mpv.socket_path)
+            mpv.latency_histogram = self.mpv.latency_histogram
+            for name in self.mpv._observed_ids:
+                if not await mpv.observe_property(name):
+                    self.log(f"failed to observe property '{name}' of MPV")
+                    sys.exit(1)
+
+            self.mpv.close()
+            self.mpv = mpv
+
+    def reinit_subsystem(self, name):
+        # Devices are bound to asyncio transports, so hardware changes are
+        # applied by restart.
+        self.exit_on_config_change(f"hardware of '{name}' changed")
+
+    def on_radar_data(self, data):
+        frame = self.radar.feed(data)
+        if frame is None:
+            return
+
+        self.radar_last_frame_t = time.monotonic()
+        self.t = self.radar_last_frame_t
+        self.dt = datetime.now()
+        self.update_radar(self.radar.decode_targets(frame, self.radar_targets))
+
+        if self.radar_histogram is not None:
+            self.radar_histogram.observe(time.monotonic() - self.t)
+
+    async def replay_radar(self):
+        # Capture replay has no file descriptor to watch, so it is polled.
+        ser = self.radar._ser
+        while True:
+            n = ser.in_waiting
+            if (n == 0) and (ser.speed is None):
+                n = self.radar.FRAME_LEN
+            if n > 0:
+                self.on_radar_data(ser.read(n))
+            await asyncio.sleep(self.RADAR_REPLAY_POLL_PERIOD)
+
+    def on_radar_lost(self, exc):
+        self.log(f"exiting due to radar connection loss ({exc})")
+        self.radar.invalidate_config_cache(self.radar_config_cache)
+        sys.exit(1)
+
+    def check_radar(self):
+        delay = self.t - self.radar_last_frame_t
+        if delay > self.RADAR_TIMEOUT:
+            self.log(f"exiting due to no radar data for {delay:.1f} seconds")
+            self.radar.invalidate_config_cache(self.radar_config_cache)
+            sys.exit(1)
+
+    async def run_task(self, task):
+        if task.deadline is None:
+            task.deadline = time.monotonic()
+
+        while True:
+            delay = task.deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            self.t = time.monotonic()
+            self.dt = datetime.now()
+
+            if self.flag_video:
+                with self.mpv.batch():
+                    task.run()
+            else:
+                task.run()
+
+    async def run(self):
+        await self.init_transports()
+
+        # Radar is driven by incoming data instead of being polled. Its
+        # duration histogram (if metrics are enabled) is kept for updates.
+        task = self.scheduler.get("radar")
+        self.radar_histogram = None if task is None else task.histogram
+        self.scheduler.tasks = [
+            t for t in self.scheduler.tasks if t.name != "radar"]
+
+        if self.flag_radar:
+            self.scheduler.add("radar_check", 1, self.check_radar)
+
+        tasks = [asyncio.create_task(self.run_task(t))
+                 for t in self.scheduler.tasks]
+        if self.flag_radar and (self.RADAR_REPLAY is not None):
+            tasks.append(asyncio.create_task(self.replay_radar()))
+
+        # First failed task (e.g. sys.exit in subsystem) stops the runtime.
+        done, pending = await asyncio.wait(
+            tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for t in pending:
+            t.cancel()
+        for t in done:
+            t.result()
@@ -1,6 +1,10 @@
+import struct
 import time
 
-from adafruit_servokit import ServoKit
+from adafruit_motor.servo import Servo
+from adafruit_pca9685 import PCA9685, PWMChannel
+import board
+import busio
 import RPi.GPIO as GPIO
 
 import utils
@@ -8,15 +12,33 @@ import utils
 
 GPIO.setmode(GPIO.BCM)
 
+class RegisterShadow():
+    # Stands in for PCA9685 behind PWMChannel: register values are stored
+    # instead of written to I2C, so poses are converted to register values
+    # by the same library code as per-channel writes.
+
+    def __init__(self, frequency, n_channels):
+        self.frequency = frequency
+        self.pwm_regs = [(0, 0)] * n_channels
+
 class Hand():
+    N_CHANNELS = 16
     N_FINGERS = 5
 
+    # PWM frequency of PCA9685 (Hz), ServoKit default.
+    PWM_FREQUENCY = 50
+
     N = None
     C = 20
     O = 80
 
     DELAY = 0.5
 
+    # PCA9685 registers.
+    MODE1 = 0x00
+    MODE1_AI = 0x20
+    LED0_ON_L = 0x06
+
     POSITIONS = {
         "none":  [N,N,N,N,N],
         "close": [C,C,C,C,C],
@@ -38,16 +60,108 @@ class Hand():
 
         self._power_pin = power_pin
         #self._position = self.POSITIONS['none']
-        self._position = self.POSITIONS['close']
+        self._position = self.POSITIONS['close'].copy()
         self._stopped = True
 
         GPIO.setup(self._power_pin, GPIO.OUT)
 
+        # I2C bus and PCA9685 are initialized once and kept across power
+        # pin toggles.
+        self._pca = PCA9685(busio.I2C(board.SCL, board.SDA))
+        self._pca.frequency = self.PWM_FREQUENCY
+        self._servos = [Servo(self._pca.channels[i]) for i in range(self.N_FINGERS)]
+
+        self._shadow = RegisterShadow(self._pca.frequency, self.N_CHANNELS)
+        self._shadow_servos = [Servo(PWMChannel(self._shadow, i))
+                               for i in range(self.N_FINGERS)]
+
+        # Angles last written to servo channels (None - released).
+        self._angles = [None] * self.N_FINGERS
+
+        # Converted poses: position tuple -> (values, angles, register block).
+        self._poses = {}
+        self._bulk = self._init_bulk()
+        if self._bulk:
+            for position in self.POSITIONS.values():
+                self._get_pose(position)
+
         self.start()
         #self.set_position_by_name("close")
 
     def _finger(self, index):
-        return self._kit.servo[index]
+        return self._servos[index]
+
+    def _init_bulk(self):
+        # Whole pose is written as one I2C block write to LED0..LED4
+        # registers, which requires register auto-increment.
+        try:
+            mode1 = self._pca.mode1_reg
+            if not mode1 & self.MODE1_AI:
+                self._pca.mode1_reg = mode1 | self.MODE1_AI
+            return True
+        except Exception as e:
+            print(f"Bulk servo writes disabled\n{e}")
+            return False
+
+    def _convert(self, index, value):
+        v = utils.clamp(value, 0, 100)
+
+        if self.inverted:
+            v = 100 - v
+
+        vf = v
+        if index == 0:
+            vf = 100 - v
+
+        angle = int((100 - vf) / 100 * 180)
+        return v, angle
+
+    def _angle_to_regs(self, index, angle):
+        # Returns (LEDn_ON, LEDn_OFF) register values the servo channel
+        # would write for angle.
+        self._shadow_servos[index].angle = angle
+        return self._shadow.pwm_regs[index]
+
+    def _get_pose(self, position):
+        key = tuple(position)
+        pose = self._poses.get(key)
+        if pose is not None:
+            return pose
+
+        if None in key:
+            return
+
+        values = []
+        angles = []
+        block = bytearray([self.LED0_ON_L])
+        for i in range(self.N_FINGERS):
+            v, angle = self._convert(i, key[i])
+            values.append(v)
+            angles.append(angle)
+            block += struct.pack("<HH", *self._angle_to_regs(i, angle))
+
+        pose = (values, angles, bytes(block))
+        self._poses[key] = pose
+        return pose
+
+    def _write_pose(self, pose):
+        values, angles, block = pose
+
+        if angles != self._angles:
+            with self._pca.i2c_device as i2c:
+                i2c.write(block)
+
+            self._angles = angles.copy()
+
+        self._position = values.copy()
+
+    def _set_angle(self, index, angle):
+        # Channel is written only if its angle changed.
+        if self._angles[index] == angle:
+            return
+
+        self._finger(index).angle = angle
+        self._angles[index] = angle
 
     @property
     def position(self):
@@ -61,22 +175,23 @@ class Hand():
         if self._stopped:
             self.start()
 
-        v = utils.clamp(value, 0, 100)
-
-        if self.inverted:
-            v = 100 - v
-
+        v, angle = self._convert(index, value)
         self._position[index] = v
+        self._set_angle(index, angle)
 
-        if index == 0:
-            v = 100 - v
+    def set_position(self, position, stop=False):
+        pose = None
+        if self._bulk:
+            pose = self._get_pose(position)
 
-        angle = (100 - v) / 100 * 180
-        self._finger(index).angle = int(angle)
+        if pose is not None:
+            if self._stopped:
+                self.start()
 
-    def set_position(self, position, stop=False):
-        for i in range(self.N_FINGERS):
-            self.set_finger_position(i, position[i])
+            self._write_pose(pose)
+        else:
+            for i in range(self.N_FINGERS):
+                self.set_finger_position(i, position[i])
 
         if stop:
             time.sleep(self.DELAY)
@@ -92,7 +207,6 @@ class Hand():
 
     def start(self):
         GPIO.output(self._power_pin, GPIO.HIGH)
-        self._kit = ServoKit(channels=16)
         self._stopped = False
 
         self.set_position(self._position)
@@ -102,7 +216,7 @@ class Hand():
             return
 
         for i in range(self.N_FINGERS):
-            self._finger(i).angle = None
+            self._set_angle(i, None)
         GPIO.output(self._power_pin, GPIO.LOW)
         self._stopped = True
 
@@ -0,0 +1,123 @@
+import atexit
+from datetime import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+
+# Asynchronous logging. Records are put to bounded in-memory queue by
+# control loop and written to console and error log by background thread
+# (QueueListener), so slow terminal or SD card does not delay ticks. When
+# writer can't keep up (e.g. error storm), new records are dropped and
+# counted instead of blocking.
+#
+# Error log (warnings and errors only) is JSON, one record per line, and
+# rotated by size, so it can't fill up SD card.
+
+STATUS_LOGGER = "controller.status"
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.n_dropped = 0
+
+    def emit(self, record):
+        # Checked before record is prepared, so dropping costs nothing.
+        if self.queue.full():
+            self.n_dropped += 1
+            return
+
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            self.n_dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class ConsoleFormatter(logging.Formatter):
+    # Status lines are printed as is, other records with timestamp.
+
+    def format(self, record):
+        if record.name == STATUS_LOGGER:
+            return record.getMessage()
+
+        return f"{datetime.fromtimestamp(record.created)}: {record.getMessage()}"
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry)
+
+
+class LogWriter():
+    # Attaches queue handler to 'name' logger (and its children, e.g. status
+    # logger; None - root logger, i.e. also loggers of modules) and starts
+    # writer thread. Records left in queue are written on close (also called
+    # at interpreter exit).
+
+    QUEUE_SIZE = 1000
+    ERROR_LOG_MAX_BYTES = 1024 * 1024
+    ERROR_LOG_BACKUP_COUNT = 3
+
+    def __init__(self, name, error_log_path, queue_size=QUEUE_SIZE,
+                 max_bytes=ERROR_LOG_MAX_BYTES, backup_count=ERROR_LOG_BACKUP_COUNT):
+        console = logging.StreamHandler(sys.stdout)
+        console.setFormatter(ConsoleFormatter())
+
+        error_log = logging.handlers.RotatingFileHandler(
+            error_log_path, maxBytes=max_bytes, backupCount=backup_count,
+            delay=True)
+        error_log.setLevel(logging.WARNING)
+        error_log.setFormatter(JsonFormatter())
+
+        self.handler = DroppingQueueHandler(queue.Queue(queue_size))
+        self._listener = logging.handlers.QueueListener(
+            self.handler.queue, console, error_log, respect_handler_level=True)
+        self._handlers = [console, error_log]
+
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+        self._listener.start()
+        atexit.register(self.close)
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    @property
+    def n_dropped(self):
+        return self.handler.n_dropped
+
+    def close(self):
+        if self._listener is None:
+            return
+
+        # Sentinel stopping writer thread needs free slot in queue.
+        self.logger.removeHandler(self.handler)
+        self.handler.queue.join()
+        self._listener.stop()
+        self._listener = None
+
+        for handler in self._handlers:
+            handler.close()
+
+        atexit.unregister(self.close)
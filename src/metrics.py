@@ -0,0 +1,224 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import logging
+import os
+from pathlib import Path
+import socketserver
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+# Minimal Prometheus instrumentation. Metrics are plain counters updated
+# without locks (single writer, value is read only when scraped). Values
+# owned by other objects (e.g. radar counters) are exported by collectors,
+# functions called only on scrape, so they cost nothing otherwise.
+
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    items = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        items.append(f'{k}="{v}"')
+    items = ",".join(items)
+    return "{" + items + "}"
+
+
+class Metric():
+    # Base of metric types. Subclasses set TYPE and implement samples(),
+    # yielding (name suffix, extra labels, value).
+
+    TYPE = None
+
+    def __init__(self, name, help_text, labels=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name, help_text, labels=None):
+        super().__init__(name, help_text, labels)
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self):
+        yield ("", None, self.value)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name, help_text, labels=None):
+        super().__init__(name, help_text, labels)
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self):
+        yield ("", None, self.value)
+
+
+class Histogram(Metric):
+    TYPE = "histogram"
+
+    def __init__(self, name, help_text, labels=None, buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        n = 0
+        for le, count in zip(self.buckets, self.counts):
+            n += count
+            yield ("_bucket", {"le": repr(float(le))}, n)
+        yield ("_bucket", {"le": "+Inf"}, self.count)
+        yield ("_sum", None, self.sum)
+        yield ("_count", None, self.count)
+
+
+class Registry():
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=None):
+        return self.add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=None):
+        return self.add(Gauge(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=None, buckets=DURATION_BUCKETS):
+        return self.add(Histogram(name, help_text, labels, buckets))
+
+    def add_collector(self, func):
+        # func() returns list of metrics with current values.
+        self.collectors.append(func)
+
+    def collect(self):
+        metrics = list(self.metrics)
+        for func in self.collectors:
+            try:
+                metrics.extend(func())
+            except Exception as e:
+                logger.error(f"Metrics collector failed\n{e}")
+
+        return metrics
+
+    def render(self):
+        # Prometheus text exposition format (version 0.0.4).
+
+        families = {}
+        for metric in self.collect():
+            families.setdefault(metric.name, []).append(metric)
+
+        lines = []
+        for name, metrics in families.items():
+            lines.append(f"# HELP {name} {metrics[0].help}")
+            lines.append(f"# TYPE {name} {metrics[0].TYPE}")
+            for metric in metrics:
+                for suffix, extra, value in metric.samples():
+                    labels = dict(metric.labels)
+                    if extra:
+                        labels.update(extra)
+                    lines.append(f"{name}{suffix}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TCPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # HTTP handler expects (host, port) client address.
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+class MetricsServer():
+    # Serves registry over HTTP (GET /metrics) on TCP port or UNIX socket
+    # from background thread.
+
+    def __init__(self, registry, host="127.0.0.1", port=None, socket_path=None):
+        if (port is None) == (socket_path is None):
+            raise ValueError("Either port or socket path of metrics server must be given.")
+
+        if socket_path is not None:
+            self.socket_path = Path(socket_path)
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+            self._server = _UnixServer(str(self.socket_path), _Handler)
+            self.address = f"unix:{self.socket_path}"
+        else:
+            self.socket_path = None
+            self._server = _TCPServer((host, port), _Handler)
+            self.address = f"http://{host}:{self._server.server_address[1]}/metrics"
+
+        self._server.registry = registry
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    def close(self):
+        if self._thread is None:
+            return
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread = None
+
+        if self.socket_path is not None:
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
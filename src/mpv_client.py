@@ -1,12 +1,22 @@
+import asyncio
+from contextlib import contextmanager
 import json
+import logging
 from pathlib import Path
+import select
 import socket
 import time
 
 
+logger = logging.getLogger(__name__)
+
+
 class MPVClient():
     DEFAULT_SOCKET_PATH = "/tmp/mpvsocket"
 
+    # Max time (seconds) to wait for response to a command.
+    TIMEOUT = 1
+
     @staticmethod
     def _j2b(j):
         t = json.dumps(j) + "\n"
@@ -29,40 +39,225 @@ class MPVClient():
             raise Exception(f"Socket '{self.socket_path}' not found")
 
         self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        self.socket.settimeout(1)
+        self.socket.settimeout(self.TIMEOUT)
         self.socket.connect(str(self.socket_path))
 
+        self._init_state()
+
+    def _init_state(self):
         self._request_id = 0
 
+        self._queue = []
+        self._batch_depth = 0
+        self._rbuf = bytearray()
+
+        self._pending = set()
+        self._responses = {}
+        self._event_callbacks = {}
+
+        self._observed_ids = {}
+        self._observed = {}
+        self.add_event_callback("property-change", self._on_property_change)
+
+        # Requests waiting for response; failed - timed out or rejected.
+        # Latency is observed by histogram if set (see metrics).
+        self.n_requests = 0
+        self.n_failures = 0
+        self.latency_histogram = None
+
+    def _on_request_done(self, res, latency):
+        self.n_requests += 1
+        if not (isinstance(res, dict) and res.get("error") == "success"):
+            self.n_failures += 1
+
+        if self.latency_histogram is not None:
+            self.latency_histogram.observe(latency)
+
     def __del__(self):
         try:
-            self.socket.close()
+            self.close()
         except:
             pass
 
+    def close(self):
+        self.socket.close()
+
     def _next_request_id(self):
         self._request_id = (self._request_id % 999) + 1
         return self._request_id
 
-    def _send_json(self, cmd):
-        request_id = self._next_request_id()
+    def _flush(self):
+        if not self._queue:
+            return
 
-        cmd_j = {"command" : cmd, "request_id": request_id}
-        cmd_b = self._j2b(cmd_j)
-        #print(cmd_b)
+        cmd_b = b"".join(self._queue)
+        self._queue.clear()
+        self.socket.sendall(cmd_b)
 
-        self.socket.send(cmd_b)
+    def _recv(self, wait=True):
+        if not wait:
+            r, _, _ = select.select([self.socket], [], [], 0)
+            if not r:
+                return False
 
         res_b = self.socket.recv(4096)
-        #print(len(res_b))
-        #print(res_b)
-        for i_res_b in res_b.split(b'\n'):
-            if not i_res_b:
+        if not res_b:
+            raise Exception(f"Socket '{self.socket_path}' closed")
+
+        self._rbuf += res_b
+        return True
+
+    def _read_lines(self):
+        # Consumes complete lines from receive buffer. Incomplete line stays
+        # in the buffer until the rest of it is received. Responses are
+        # routed to pending requests by request_id, events are passed to
+        # callbacks, everything else (e.g. responses to fire-and-forget
+        # commands) is dropped.
+
+        while True:
+            i = self._rbuf.find(b'\n')
+            if i < 0:
+                return
+
+            res_b = bytes(self._rbuf[:i])
+            del self._rbuf[:i+1]
+            if not res_b:
                 continue
 
-            res_j = self._b2j(i_res_b)
-            if "request_id" in res_j and res_j["request_id"] == request_id:
-                return res_j
+            try:
+                res_j = self._b2j(res_b)
+            except ValueError:
+                logger.error(f"Invalid message from MPV: {res_b}")
+                continue
+
+            if "event" in res_j:
+                self._dispatch_event(res_j)
+                continue
+
+            self._on_response(res_j)
+
+    def _on_response(self, res_j):
+        request_id = res_j.get("request_id")
+        if request_id in self._pending:
+            self._responses[request_id] = res_j
+
+    def _dispatch_event(self, event):
+        callbacks = self._event_callbacks.get(event["event"], [])
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"MPV event callback for '{event['event']}' failed\n{e}")
+
+    def add_event_callback(self, name, callback):
+        self._event_callbacks.setdefault(name, []).append(callback)
+
+    def remove_event_callback(self, name, callback):
+        callbacks = self._event_callbacks.get(name, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def _on_property_change(self, event):
+        name = event.get("name")
+        if name in self._observed_ids:
+            self._observed[name] = event.get("data")
+
+    def observe_property(self, name):
+        # MPV sends property-change event with the initial value and then
+        # on every change. Cached value is available via get_observed().
+
+        if name in self._observed_ids:
+            return True
+
+        observe_id = max(self._observed_ids.values(), default=0) + 1
+        self._observed_ids[name] = observe_id
+        self._observed[name] = None
+
+        res = self._send_json(["observe_property", observe_id, name])
+        if not (isinstance(res, dict) and res.get("error") == "success"):
+            del self._observed_ids[name]
+            del self._observed[name]
+            return False
+
+        return True
+
+    def unobserve_property(self, name):
+        observe_id = self._observed_ids.pop(name, None)
+        if observe_id is None:
+            return
+
+        del self._observed[name]
+        self._send_json(["unobserve_property", observe_id], wait=False)
+
+    def get_observed(self, name):
+        # Returns last value pushed by MPV (None if unknown) without IPC.
+        # Call poll_events() (or any command) to process pending updates.
+        return self._observed.get(name)
+
+    def poll_events(self):
+        # Reads everything available without blocking and dispatches events.
+        while self._recv(wait=False):
+            self._read_lines()
+
+    def _wait_response(self, request_id, t_start):
+        # Events (e.g. changes of observed properties) keep arriving while
+        # waiting, so timeout is checked against one deadline.
+
+        deadline = t_start + self.TIMEOUT
+        self._pending.add(request_id)
+        try:
+            while request_id not in self._responses:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    return
+
+                r, _, _ = select.select([self.socket], [], [], timeout)
+                if not r:
+                    return
+
+                self._recv()
+                self._read_lines()
+
+            return self._responses.pop(request_id)
+        finally:
+            # Late response to timed out request is dropped when received.
+            self._pending.discard(request_id)
+
+    def _send_json(self, cmd, wait=True):
+        # With wait=False command is fire-and-forget: its response is
+        # dropped. Inside batch() such commands are queued and sent with
+        # the next waiting command or when the batch ends.
+
+        request_id = self._next_request_id()
+
+        cmd_j = {"command" : cmd, "request_id": request_id}
+        self._queue.append(self._j2b(cmd_j))
+
+        if not wait:
+            if self._batch_depth == 0:
+                self._flush()
+                self.poll_events()
+            return
+
+        self._flush()
+        t_start = time.monotonic()
+        res = self._wait_response(request_id, t_start)
+        self._on_request_done(res, time.monotonic() - t_start)
+        return res
+
+    @contextmanager
+    def batch(self):
+        # Pipelines commands: all fire-and-forget commands issued inside the
+        # block are written to the socket with one sendall.
+
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._flush()
+                self.poll_events()
 
     def get_property(self, name):
         cmd = ["get_property", name]
@@ -70,9 +265,9 @@ class MPVClient():
         if isinstance(res, dict) and 'data' in res:
             return res['data']
 
-    def set_property(self, name, value):
+    def set_property(self, name, value, wait=True):
         cmd = ["set_property", name, value]
-        return self._send_json(cmd)
+        return self._send_json(cmd, wait)
 
     def clear(self):
         cmd = ["stop"]
@@ -89,9 +284,9 @@ class MPVClient():
         cmd = ["seek", pos, "absolute"]
         return self._send_json(cmd)
 
-    def show_text(self, text):
+    def show_text(self, text, wait=True):
         cmd = ["show-text", text]
-        return self._send_json(cmd)
+        return self._send_json(cmd, wait)
 
     def show_progress(self):
         cmd = ["show-progress"]
@@ -103,23 +298,137 @@ class MPVClient():
     def pause(self):
         return self.set_property("pause", True)
 
-    def set_brightness(self, value, osd=False):
+    def set_brightness(self, value, osd=False, wait=True):
         v = max(-100, min(100, value))
         if osd:
-            self.show_text(f"brightness: {v}")
+            self.show_text(f"brightness: {v}", wait)
 
-        return self.set_property("brightness", v)
+        return self.set_property("brightness", v, wait)
 
-    def set_drm_brightness(self, value, osd=False):
+    def set_drm_brightness(self, value, osd=False, wait=True):
         v = max(0, min(65535, value))
         if osd:
-            self.show_text(f"drm-brightness: {v}")
+            self.show_text(f"drm-brightness: {v}", wait)
 
-        return self.set_property("drm-brightness", v)
+        return self.set_property("drm-brightness", v, wait)
 
-    def set_x_overlay(self, overlay_name, x, osd=False):
+    def set_x_overlay(self, overlay_name, x, osd=False, wait=True):
         if osd:
-            self.show_text(f"{overlay_name} X: {x: 4}")
+            self.show_text(f"{overlay_name} X: {x: 4}", wait)
 
         cmd = ["vf-command", "all", f"x@overlay@{overlay_name}", str(x)]
-        return self._send_json(cmd)
+        return self._send_json(cmd, wait)
+
+
+class AsyncMPVClient(MPVClient):
+    # MPV client for asyncio runtime. Fire-and-forget commands (wait=False)
+    # are written to the stream without blocking, so the same sync API can
+    # be used from subsystems. Commands that need a response are coroutines.
+    # Responses and events are read by a background task.
+
+    def __init__(self, reader, writer, socket_path):
+        self.socket_path = Path(socket_path)
+        self._stream_reader = reader
+        self._stream_writer = writer
+
+        self._init_state()
+        self._pending = {}
+
+        self._read_task = asyncio.create_task(self._read_loop())
+
+    @classmethod
+    async def connect(cls, socket_path=None):
+        if socket_path is None:
+            socket_path = Path(cls.DEFAULT_SOCKET_PATH)
+        else:
+            socket_path = Path(socket_path)
+
+        if not socket_path.is_socket():
+            raise Exception(f"Socket '{socket_path}' not found")
+
+        reader, writer = await asyncio.open_unix_connection(str(socket_path))
+        return cls(reader, writer, socket_path)
+
+    def close(self):
+        self._read_task.cancel()
+        self._stream_writer.close()
+
+    async def _read_loop(self):
+        while True:
+            res_b = await self._stream_reader.read(4096)
+            if not res_b:
+                logger.error(f"Socket '{self.socket_path}' closed")
+                return
+
+            self._rbuf += res_b
+            self._read_lines()
+
+    def _on_response(self, res_j):
+        future = self._pending.pop(res_j.get("request_id"), None)
+        if (future is not None) and (not future.done()):
+            future.set_result(res_j)
+
+    def _flush(self):
+        if not self._queue:
+            return
+
+        cmd_b = b"".join(self._queue)
+        self._queue.clear()
+        self._stream_writer.write(cmd_b)
+
+    def poll_events(self):
+        # Events are dispatched by the read task.
+        pass
+
+    def _send_json(self, cmd, wait=True):
+        # Returns awaitable response if wait is True.
+
+        request_id = self._next_request_id()
+
+        cmd_j = {"command" : cmd, "request_id": request_id}
+        self._queue.append(self._j2b(cmd_j))
+
+        if (not wait) and (self._batch_depth > 0):
+            return
+
+        self._flush()
+
+        if wait:
+            # Future is registered before returning, so response can not be
+            # missed even if caller awaits it later.
+            future = asyncio.get_running_loop().create_future()
+            self._pending[request_id] = future
+            return self._wait_response(request_id, future, time.monotonic())
+
+    async def _wait_response(self, request_id, future, t_start):
+        res = None
+        try:
+            res = await asyncio.wait_for(future, self.TIMEOUT)
+            return res
+        except asyncio.TimeoutError:
+            return
+        finally:
+            self._pending.pop(request_id, None)
+            self._on_request_done(res, time.monotonic() - t_start)
+
+    async def get_property(self, name):
+        cmd = ["get_property", name]
+        res = await self._send_json(cmd)
+        if isinstance(res, dict) and 'data' in res:
+            return res['data']
+
+    async def observe_property(self, name):
+        if name in self._observed_ids:
+            return True
+
+        observe_id = max(self._observed_ids.values(), default=0) + 1
+        self._observed_ids[name] = observe_id
+        self._observed[name] = None
+
+        res = await self._send_json(["observe_property", observe_id, name])
+        if not (isinstance(res, dict) and res.get("error") == "success"):
+            del self._observed_ids[name]
+            del self._observed[name]
+            return False
+
+        return True
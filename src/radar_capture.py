@@ -0,0 +1,251 @@
+from pathlib import Path
+import struct
+import time
+
+from radar_ld2450 import LD2450
+
+
+# Capture file: header (magic, version, frame length) followed by records
+# of monotonic timestamp (seconds, double) and raw frame. Records are
+# buffered and appended to file in chunks.
+
+MAGIC = b"LD2450CP"
+VERSION = 1
+
+HEADER = struct.Struct("<8sHH")
+RECORD = struct.Struct(f"<d{LD2450.FRAME_LEN}s")
+
+
+class CaptureWriter():
+    CHUNK_RECORDS = 256
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._f = self.path.open("wb")
+        self._f.write(HEADER.pack(MAGIC, VERSION, LD2450.FRAME_LEN))
+
+        self._chunk = bytearray(RECORD.size * self.CHUNK_RECORDS)
+        self._n = 0
+
+        self.n_records = 0
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    def write(self, t, frame):
+        RECORD.pack_into(self._chunk, self._n * RECORD.size, t, bytes(frame))
+        self._n += 1
+        self.n_records += 1
+
+        if self._n == self.CHUNK_RECORDS:
+            self.flush()
+
+    def flush(self):
+        if self._n > 0:
+            self._f.write(memoryview(self._chunk)[:self._n * RECORD.size])
+            self._n = 0
+
+        self._f.flush()
+
+    def close(self):
+        if self._f.closed:
+            return
+
+        self.flush()
+        self._f.close()
+
+
+class CaptureReader():
+    CHUNK_RECORDS = 256
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+        with self.path.open("rb") as f:
+            header = f.read(HEADER.size)
+
+        if len(header) < HEADER.size:
+            raise Exception(f"Capture file '{self.path}' is too short.")
+
+        magic, version, frame_len = HEADER.unpack(header)
+        if magic != MAGIC:
+            raise Exception(f"File '{self.path}' is not radar capture.")
+
+        if version != VERSION:
+            raise Exception(f"Unsupported version {version} of capture file '{self.path}'.")
+
+        if frame_len != LD2450.FRAME_LEN:
+            raise Exception(f"Unsupported frame length {frame_len} in capture file '{self.path}'.")
+
+    def __iter__(self):
+        # Yields (timestamp, frame); incomplete last record is ignored.
+
+        with self.path.open("rb") as f:
+            f.seek(HEADER.size)
+            while True:
+                chunk = f.read(RECORD.size * self.CHUNK_RECORDS)
+                n = len(chunk) // RECORD.size
+                for i in range(n):
+                    yield RECORD.unpack_from(chunk, i * RECORD.size)
+
+                if n < self.CHUNK_RECORDS:
+                    break
+
+
+class ReplaySerial():
+    # Serial-like source of captured frames. Frames become available at
+    # their captured times scaled by speed (e.g. 2 - twice as fast); speed
+    # None replays without delays: next frame is released only by read,
+    # one at a time, so decoder skips no frames. Reads time out like real
+    # serial port.
+
+    def __init__(self, path, speed=1, loop=False, timeout=1):
+        self.reader = CaptureReader(path)
+        self.speed = speed
+        self.loop = loop
+        self.timeout = timeout
+
+        self._pending = bytearray()
+        self._start()
+
+    def _start(self):
+        self._records = iter(self.reader)
+        self._next = next(self._records, None)
+        self._t0 = None if self._next is None else self._next[0]
+        self._start_t = time.monotonic()
+
+    def _due(self, t):
+        if self.speed is None:
+            return not self._pending
+
+        return (time.monotonic() - self._start_t) * self.speed >= t - self._t0
+
+    def _fill(self):
+        while True:
+            if self._next is None:
+                if not self.loop or self._t0 is None:
+                    return
+                self._start()
+                continue
+
+            t, frame = self._next
+            if not self._due(t):
+                return
+
+            self._pending += frame
+            self._next = next(self._records, None)
+
+    @property
+    def done(self):
+        return (self._next is None) and not self._pending and not self.loop
+
+    @property
+    def in_waiting(self):
+        if self.speed is not None:
+            self._fill()
+        return len(self._pending)
+
+    def readinto(self, b):
+        t_end = time.monotonic() + self.timeout
+        while True:
+            self._fill()
+            if (len(self._pending) >= len(b)) or (self._next is None):
+                break
+
+            # Unthrottled replay releases one frame per read.
+            if self.speed is None:
+                break
+
+            t = time.monotonic()
+            if t >= t_end:
+                break
+
+            t_next = (self._next[0] - self._t0) / self.speed + self._start_t
+            time.sleep(min(max(t_next - t, 0.001), t_end - t))
+
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        del self._pending[:n]
+        return n
+
+    def read(self, size=1):
+        b = bytearray(size)
+        n = self.readinto(b)
+        return bytes(b[:n])
+
+    def reset_input_buffer(self):
+        self._fill()
+        self._pending.clear()
+
+    def write(self, data):
+        raise Exception("Cannot send commands to radar replay.")
+
+    def close(self):
+        pass
+
+
+class LD2450Replay(LD2450):
+    # LD2450 reading frames from capture file instead of UART.
+
+    def __init__(self, path, speed=1, loop=False, verbose=False):
+        self.speed = speed
+        self.loop = loop
+        super().__init__(path, verbose=verbose)
+
+    def _get_serial(self):
+        return ReplaySerial(self.uartdev, self.speed, self.loop)
+
+    def ensure_config(self, *args, **kwargs):
+        # Captured frames are already produced by configured radar.
+        return False
+
+    def invalidate_config_cache(self, path):
+        pass
+
+
+if __name__ == "__main__":
+    import sys
+
+    try:
+        cmd = sys.argv[1]
+        if cmd not in ["record", "replay"]:
+            raise Exception
+        path = sys.argv[2]
+    except:
+        print("\nUsage:\n"
+              "- record <uartdev> <path> [seconds]: capturing radar frames\n"
+              "- replay <path> [speed]: printing captured data\n")
+        sys.exit(1)
+
+    if cmd == "record":
+        r = LD2450(path)
+        r.start_recording(sys.argv[3])
+
+        try:
+            duration = float(sys.argv[4])
+        except:
+            duration = None
+
+        t_end = None if duration is None else time.monotonic() + duration
+        try:
+            while (t_end is None) or (time.monotonic() < t_end):
+                r.get_frame()
+        except KeyboardInterrupt:
+            pass
+
+        r.stop_recording()
+        print(f"Recorded {r.n_frames} frames")
+    else:
+        try:
+            speed = float(sys.argv[3])
+        except:
+            speed = 1
+
+        r = LD2450Replay(path, speed=speed)
+        while not r._ser.done:
+            data = r.get_data()
+            if data is not None:
+                print(" | ".join([f"{x:5} {y:5}" for (x,y) in data]))
@@ -1,9 +1,62 @@
+from array import array
+from contextlib import contextmanager
+import json
+import logging
 import math
 from datetime import datetime, timedelta
+from pathlib import Path
 import serial
+import struct
+import threading
 import time
 
 
+logger = logging.getLogger(__name__)
+
+
+class Targets():
+    # Preallocated storage of targets decoded from one frame. Arrays are
+    # reused between frames, so decoding creates no per-target objects.
+    # Only the first n entries are valid; nearest is index of the closest
+    # target (-1 if there are no targets).
+
+    MAX_TARGETS = 3
+
+    def __init__(self, max_targets=MAX_TARGETS):
+        self.max_targets = max_targets
+
+        self.x = array('i', [0] * max_targets)
+        self.y = array('i', [0] * max_targets)
+        self.speed = array('i', [0] * max_targets)
+        self.resolution = array('i', [0] * max_targets)
+        self.distance = array('d', [0.0] * max_targets)
+        self.angle = array('d', [0.0] * max_targets)
+
+        self.n = 0
+        self.nearest = -1
+        self.seq = 0
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        # Yields (x, y) of valid targets, like LD2450.parse_frame().
+        for i in range(self.n):
+            yield (self.x[i], self.y[i])
+
+    def copy_from(self, other):
+        n = other.n
+        self.x[:n] = other.x[:n]
+        self.y[:n] = other.y[:n]
+        self.speed[:n] = other.speed[:n]
+        self.resolution[:n] = other.resolution[:n]
+        self.distance[:n] = other.distance[:n]
+        self.angle[:n] = other.angle[:n]
+        self.n = n
+        self.nearest = other.nearest
+        self.seq = other.seq
+
+
 class LD2450():
     CMD_HEADER = bytes([0xFD, 0xFC, 0xFB, 0xFA])
     CMD_EOF = bytes([0x04, 0x03, 0x02, 0x01])
@@ -11,6 +64,19 @@ class LD2450():
     DATA_HEADER = bytes([0xAA, 0xFF, 0x03, 0x00])
     DATA_EOF = bytes([0x55, 0xCC])
 
+    # Frame: header (4 bytes) + 3 targets x 4 uint16 fields + EOF (2 bytes).
+    FRAME_LEN = 30
+    FRAME_TARGETS = struct.Struct("<12H")
+
+    BUFFER_SIZE = 4096
+
+    CMD_N_ATTEMPTS = 4
+
+    # Radar needs some time to reboot before it can be reopened; afterwards
+    # restart is complete as soon as the first data frame arrives.
+    RESTART_DELAY = 0.5
+    RESTART_TIMEOUT = 5
+
     ANGLE_MIN = -math.pi/2 * 2/3
     ANGLE_MAX =  math.pi/2 * 2/3
 
@@ -21,7 +87,11 @@ class LD2450():
     @staticmethod
     def _convert_data_int16(bs, signed):
         v = int.from_bytes(bs, byteorder='little')
+        return LD2450._convert_int16(v, signed)
 
+    @staticmethod
+    def _convert_int16(v, signed):
+        # Signed values use MSB as sign bit (1 - positive, 0 - negative).
         if signed:
             if v < 2**15:
                 v = -v
@@ -37,11 +107,12 @@ class LD2450():
 
     @staticmethod
     def distance(t):
-        return math.sqrt(t[0]**2 + t[1]**2)
-    
+        return math.hypot(t[0], t[1])
+
     @staticmethod
     def angle(t):
-        return math.atan(t[0]/t[1])
+        # Angle from radar axis (y), positive to the right (x > 0).
+        return math.atan2(t[0], t[1])
 
     def __init__(self, uartdev, verbose=False):
         self.uartdev = uartdev
@@ -49,6 +120,31 @@ class LD2450():
 
         self._ser = self._get_serial()
 
+        self._buf = bytearray(self.BUFFER_SIZE)
+        self._buf_view = memoryview(self._buf)
+        self._buf_len = 0
+
+        self._frame = bytearray(self.FRAME_LEN)
+        self._frame_view = memoryview(self._frame)
+
+        self.n_frames = 0
+        self.n_skipped_bytes = 0
+        self.n_invalid_headers = 0
+        self.n_overflows = 0
+
+        self._reader = None
+        self._reader_stop = threading.Event()
+        self._reader_targets = [Targets() for i in range(3)]
+        self._latest = (0, None)
+        self._latest_read_seq = 0
+        self.reader_n_failures = 0
+        self.n_dropped_frames = 0
+
+        self._in_configuration = False
+        self._restart_pending = False
+
+        self._recorder = None
+
     def _get_serial(self):
         try:
             return serial.Serial(self.uartdev, 256000, timeout=1)
@@ -57,10 +153,32 @@ class LD2450():
 
     def __del__(self):
         try:
-            self._ser.close()
+            self.close()
         except:
             pass
 
+    def close(self):
+        self.stop_reader()
+        self.stop_recording()
+        self._ser.close()
+
+    def start_recording(self, path):
+        # Every valid frame decoded by get_frame() or feed(), including
+        # frames superseded by newer ones in the same read, is appended to
+        # capture file (see radar_capture) with its monotonic timestamp.
+
+        from radar_capture import CaptureWriter
+
+        self.stop_recording()
+        self._recorder = CaptureWriter(path)
+
+    def stop_recording(self):
+        if self._recorder is None:
+            return
+
+        self._recorder.close()
+        self._recorder = None
+
     @property
     def in_waiting(self):
         return self._ser.in_waiting
@@ -105,46 +223,89 @@ class LD2450():
         cmd_value = []
         self._send_cmd(cmd_word, cmd_value)
 
+    def _enter_configuration(self):
+        for i in range(self.CMD_N_ATTEMPTS):
+            try:
+                self._start_configuration()
+                return
+            except Exception as e:
+                logger.error(f"Failed to start configuration\n{e}")
+
+        raise Exception(f"Failed to start configuration of radar '{self.uartdev}'.")
+
+    def _send_restart(self):
+        cmd_word = [0x00, 0xA3]
+        cmd_value = []
+        self._send_cmd(cmd_word, cmd_value)
+
+    def _leave_configuration(self):
+        # Radar leaves configuration mode by itself when restarting.
+        restart = self._restart_pending
+        self._restart_pending = False
+        if restart:
+            func, text = self._send_restart, "restart radar"
+        else:
+            func, text = self._end_configuration, "end configuration"
+
+        for i in range(self.CMD_N_ATTEMPTS):
+            try:
+                func()
+                break
+            except Exception as e:
+                logger.error(f"Failed to {text}\n{e}")
+        else:
+            raise Exception(f"Failed to {text} of radar '{self.uartdev}'.")
+
+        if restart:
+            self._wait_restart()
+
+    @contextmanager
+    def configuration(self):
+        # Configuration session: radar enters configuration mode once for
+        # all commands executed inside and leaves it on exit. Nested
+        # sessions are merged into the outer one. Radar sends no data
+        # frames during the session.
+
+        if self._in_configuration:
+            yield
+            return
+
+        if self.reader_running:
+            raise Exception("Cannot start configuration while reader thread is running.")
+
+        self._enter_configuration()
+        self._in_configuration = True
+        try:
+            yield
+        finally:
+            self._in_configuration = False
+            self._leave_configuration()
+
     def _execute_cmd(self, cmd_word, cmd_value, reverse_value=True):
         cmd_word_str = self.bs2str(cmd_word)
 
-        n = 4
-        for l in range(n):
-            for i in range(n):
-                try:
-                    self._start_configuration()
-                    break
-                except Exception as e:
-                    print(f"Failed to start configuration\n{e}")
-            else:
-                raise Exception(f"Failed to start configuration while executing cmd '{cmd_word_str}'.")
+        if self.reader_running:
+            raise Exception(f"Cannot execute cmd '{cmd_word_str}' while reader thread is running.")
 
-            for i in range(n):
-                try:
-                    res = self._send_cmd(cmd_word, cmd_value, reverse_value)
-                    break
-                except Exception as e:
-                    print(f"Failed to execute cmd '{cmd_word_str}'\n{e}")
-            else:
-                print(f"Failed to execute cmd '{cmd_word_str}'.")
-                continue
+        with self.configuration():
+            n = self.CMD_N_ATTEMPTS
+            for l in range(n):
+                for i in range(n):
+                    try:
+                        return self._send_cmd(cmd_word, cmd_value, reverse_value)
+                    except Exception as e:
+                        logger.error(f"Failed to execute cmd '{cmd_word_str}'\n{e}")
 
-            for i in range(n):
+                # Radar may have dropped out of configuration mode.
+                logger.warning(f"Failed to execute cmd '{cmd_word_str}', restarting configuration.")
                 try:
                     self._end_configuration()
-                    break
-                except Exception as e:
-                    print(f"Failed to end configuration\n{e}")
-            else:
-                print(f"Failed to end configuration while executing cmd '{cmd_word_str}'.")
-                continue
+                except:
+                    pass
+                self._enter_configuration()
 
-            break
-        else:
             raise Exception(f"Failed to execute cmd '{cmd_word_str}'.")
 
-        return res
-
     def get_firmware_version(self, raw=False):
         cmd_word = [0x00, 0xA0]
         cmd_value = []
@@ -160,12 +321,22 @@ class LD2450():
         return f"V{vx}.{vy:02}.{vz}"
 
     def restart(self):
-        cmd_word = [0x00, 0xA3]
-        cmd_value = []
-        self._execute_cmd(cmd_word, cmd_value)
-        time.sleep(3)
+        # Restart ends configuration mode, so it is done when configuration
+        # session is left.
+        with self.configuration():
+            self._restart_pending = True
+
+    def _wait_restart(self):
+        time.sleep(self.RESTART_DELAY)
 
+        self._ser.close()
         self._ser = self._get_serial()
+        self.clean()
+
+        dt_end = datetime.now() + timedelta(seconds=self.RESTART_TIMEOUT)
+        while self.get_frame() is None:
+            if datetime.now() > dt_end:
+                raise Exception(f"No data from radar '{self.uartdev}' after restart.")
 
     def restore_factory_settings(self, restart=False):
         # Baudrate: 256000.
@@ -302,25 +473,107 @@ class LD2450():
 
         self._execute_cmd(cmd_word, cmd_value, reverse_value=False)
 
-    def show_info(self):
-        firmware_version = self.get_firmware_version()
+    def get_config(self):
+        with self.configuration():
+            return {
+                "bluetooth": self.get_bluetooth_state(),
+                "multi_tracking": self.get_tracking_mode() == 2,
+                "zone_filtering": self.get_zone_filtering()[0],
+            }
+
+    @staticmethod
+    def _load_config_cache(path):
+        try:
+            with Path(path).open("r") as f:
+                return json.load(f)
+        except:
+            return {}
+
+    def invalidate_config_cache(self, path):
+        cache = self._load_config_cache(path)
+        if cache.pop(self.uartdev, None) is not None:
+            with Path(path).open("w") as f:
+                json.dump(cache, f)
+
+    def ensure_config(self, bluetooth=False, multi_tracking=True,
+                      zone_filtering=0, cache_path=None):
+        # Reads current configuration and applies only differences, so
+        # radar is restarted only if Bluetooth state changes. Configuration
+        # applied before is remembered per device in cache file (if given)
+        # together with firmware version of the module.
+        #
+        # Cached configuration is trusted after a short read-back: firmware
+        # version (another module on the same device) and Bluetooth state
+        # (enabled again by factory reset). Returns True if anything was
+        # changed.
+
+        config = {
+            "bluetooth": bluetooth,
+            "multi_tracking": multi_tracking,
+            "zone_filtering": zone_filtering,
+        }
+
+        if cache_path is not None:
+            entry = self._load_config_cache(cache_path).get(self.uartdev)
+            if isinstance(entry, dict) and (entry.get("config") == config):
+                with self.configuration():
+                    firmware_version = self.get_firmware_version()
+                    bluetooth_state = self.get_bluetooth_state()
+
+                if (firmware_version == entry.get("firmware_version")) and \
+                   (bluetooth_state == bluetooth):
+                    return False
+
+                logger.warning(f"Cached configuration of radar '{self.uartdev}' does not match device")
+
+        with self.configuration():
+            firmware_version = self.get_firmware_version()
+            current = self.get_config()
+
+            if current["multi_tracking"] != multi_tracking:
+                if multi_tracking:
+                    self.set_multi_tracking()
+                else:
+                    self.set_single_tracking()
+
+            if current["zone_filtering"] != zone_filtering:
+                self.set_zone_filtering(mode=zone_filtering)
+
+            if current["bluetooth"] != bluetooth:
+                if bluetooth:
+                    self.set_bluetooth_on(restart=True)
+                else:
+                    self.set_bluetooth_off(restart=True)
+
+        if cache_path is not None:
+            cache = self._load_config_cache(cache_path)
+            cache[self.uartdev] = {
+                "config": config,
+                "firmware_version": firmware_version,
+            }
+            with Path(cache_path).open("w") as f:
+                json.dump(cache, f)
 
-        bl_state = self.get_bluetooth_state()
-        if bl_state:
+        return current != config
+
+    def show_info(self):
+        with self.configuration():
+            firmware_version = self.get_firmware_version()
             mac_address = self.get_mac_address()
+            tracking_mode = self.get_tracking_mode()
+            zone_filtering = self.get_zone_filtering()
+
+        if len(mac_address) == 17:
             bl_state = "ON"
         else:
             mac_address = "---"
             bl_state = "OFF"
 
-        tracking_mode = self.get_tracking_mode()
         if tracking_mode == 1:
             mt_state = "OFF"
         else:
             mt_state = "ON"
 
-        zone_filtering = self.get_zone_filtering()
-
         print(f"UART device: {self.uartdev}")
         print(f"Firmware version: {firmware_version}")
         print(f"Bluetooth: {bl_state} (MAC address: {mac_address})")
@@ -332,16 +585,17 @@ class LD2450():
         l2 = []
         l3 = []
         
-        for i in range(n):
-            print(i)
-        
-            firmware_version = self.get_firmware_version()
-            mac_address = self.get_mac_address()
-            tracking_mode_index = self.get_tracking_mode()
-        
-            l1.append(firmware_version)
-            l2.append(mac_address)
-            l3.append(tracking_mode_index)
+        with self.configuration():
+            for i in range(n):
+                print(i)
+
+                firmware_version = self.get_firmware_version()
+                mac_address = self.get_mac_address()
+                tracking_mode_index = self.get_tracking_mode()
+
+                l1.append(firmware_version)
+                l2.append(mac_address)
+                l3.append(tracking_mode_index)
         
         print()
         print(f"Firmware version: {sorted(set(l1))}")
@@ -349,43 +603,149 @@ class LD2450():
         print(f"Tracking mode: {sorted(set(l3))}")
 
     def clean(self, ret=False):
+        self._buf_len = 0
+
         if ret:
             return self._ser.read(size=self.in_waiting)
         else:
             self._ser.reset_input_buffer()
 
-    def get_frame(self):
-        n_all = self.in_waiting
-        if n_all >= 60:
-            n_skipped = n_all - 30
-            _ = self._ser.read(n_skipped)
-            res = self._ser.read_until(self.DATA_EOF)
-            n_skipped += len(res)
-            print(f"Skipping {n_skipped} bytes")
+    def _decode_buffer(self):
+        # Scans buffer for complete frames, copies the newest one into
+        # self._frame and moves the unprocessed tail to the buffer start.
+        # Returns number of frames found.
+
+        buf = self._buf
+        end = self._buf_len
+        header = self.DATA_HEADER
+        eof_1, eof_2 = self.DATA_EOF
+
+        pos = 0
+        last = -1
+        n_frames = 0
+        while True:
+            i = buf.find(header, pos, end)
+            if i < 0:
+                # Tail may hold beginning of the next header.
+                tail = max(pos, end - len(header) + 1)
+                self.n_skipped_bytes += tail - pos
+                pos = tail
+                break
+
+            if i != pos:
+                self.n_skipped_bytes += i - pos
+                self.n_invalid_headers += 1
+
+            if end - i < self.FRAME_LEN:
+                pos = i
+                break
+
+            j = i + self.FRAME_LEN
+            if (buf[j-2] != eof_1) or (buf[j-1] != eof_2):
+                self.n_skipped_bytes += 1
+                self.n_invalid_headers += 1
+                pos = i + 1
+                continue
+
+            if self._recorder is not None:
+                self._recorder.write(time.monotonic(), self._buf_view[i:j])
+
+            if last >= 0:
+                self.n_skipped_bytes += self.FRAME_LEN
+
+            last = i
+            n_frames += 1
+            pos = j
+
+        if last >= 0:
+            self._frame_view[:] = self._buf_view[last:last+self.FRAME_LEN]
+
+        n_rest = end - pos
+        if pos > 0 and n_rest > 0:
+            self._buf_view[:n_rest] = self._buf_view[pos:end]
+        self._buf_len = n_rest
 
-        res = self._ser.read_until(self.DATA_EOF)
+        return n_frames
+
+    def get_frame(self, block=True):
+        # Returned memoryview is reused and valid until the next call.
+        # Non-blocking call decodes only bytes already received and returns
+        # None without reading if they hold no complete frame.
+
+        n_skipped = self.n_skipped_bytes
+        n_frames = 0
+        while True:
+            n = self.in_waiting
+            if n == 0:
+                if (n_frames > 0) or not block:
+                    break
+                n = self.FRAME_LEN - self._buf_len
+
+            n_free = self.BUFFER_SIZE - self._buf_len
+            if n > n_free:
+                self.n_overflows += 1
+                n = n_free
+            n_read = self._ser.readinto(
+                self._buf_view[self._buf_len:self._buf_len+n])
+            self._buf_len += n_read
+
+            n_new = self._decode_buffer()
+            if n_new > 0 and n_frames > 0:
+                # Frame found by previous read was overwritten.
+                self.n_skipped_bytes += self.FRAME_LEN
+            n_frames += n_new
+
+            if n_read < n:
+                break
 
-        if res[-30:-26] != self.DATA_HEADER:
-            print("Invalid data header")
+        if self.verbose:
+            n_skipped = self.n_skipped_bytes - n_skipped
+            if n_skipped > 0:
+                print(f"Skipping {n_skipped} bytes")
+
+        if n_frames == 0:
+            if self.verbose and block:
+                print("Invalid data header")
             return
 
-        return res
-        
+        self.n_frames += 1
+        return self._frame_view
+
+    def feed(self, data):
+        # Decodes bytes received by other means (e.g. asyncio transport).
+        # Returns the newest complete frame (reused memoryview) or None.
+
+        view = memoryview(data)
+        n_frames = 0
+        while len(view) > 0:
+            n = min(len(view), self.BUFFER_SIZE - self._buf_len)
+            self._buf_view[self._buf_len:self._buf_len+n] = view[:n]
+            self._buf_len += n
+            view = view[n:]
+
+            n_new = self._decode_buffer()
+            if n_new > 0 and n_frames > 0:
+                self.n_skipped_bytes += self.FRAME_LEN
+            n_frames += n_new
+
+        if n_frames == 0:
+            return
+
+        self.n_frames += 1
+        return self._frame_view
+
     def parse_frame(self, frame, full=False):
-        payload = frame[-26:-4]
+        offset = len(frame) - self.FRAME_LEN + len(self.DATA_HEADER)
+        values = self.FRAME_TARGETS.unpack_from(frame, offset)
 
         data = []
-        for i in range(3):
-            from_i = i * 8
-            to_i = from_i + 8
-            c = payload[from_i:to_i]
-
-            x = self._convert_data_int16(c[0:2], signed=True)
-            y = self._convert_data_int16(c[2:4], signed=True)
+        for i in range(0, 12, 4):
+            x = self._convert_int16(values[i], signed=True)
+            y = self._convert_int16(values[i+1], signed=True)
             if (x != 0) and (y != 0):
                 if full:
-                    s = self._convert_data_int16(c[4:6], signed=True)
-                    d = self._convert_data_int16(c[4:6], signed=False)
+                    s = self._convert_int16(values[i+2], signed=True)
+                    d = values[i+3]
                     idata = (x,y,s,d)
                 else:
                     idata = (x,y)
@@ -394,6 +754,56 @@ class LD2450():
 
         return data
 
+    def decode_targets(self, frame, targets):
+        # Decodes frame into preallocated targets in one pass, computing
+        # distance, angle and the nearest target on the way.
+
+        offset = len(frame) - self.FRAME_LEN + len(self.DATA_HEADER)
+        values = self.FRAME_TARGETS.unpack_from(frame, offset)
+        convert = self._convert_int16
+        hypot = math.hypot
+        atan2 = math.atan2
+
+        n = 0
+        nearest = -1
+        nearest_distance = math.inf
+        for i in range(0, 12, 4):
+            x = convert(values[i], signed=True)
+            y = convert(values[i+1], signed=True)
+            if (x == 0) or (y == 0):
+                continue
+
+            if n == targets.max_targets:
+                break
+
+            d = hypot(x, y)
+            targets.x[n] = x
+            targets.y[n] = y
+            targets.speed[n] = convert(values[i+2], signed=True)
+            targets.resolution[n] = values[i+3]
+            targets.distance[n] = d
+            targets.angle[n] = atan2(x, y)
+
+            if d < nearest_distance:
+                nearest_distance = d
+                nearest = n
+
+            n += 1
+
+        targets.n = n
+        targets.nearest = nearest
+        return targets
+
+    def get_targets(self, targets, block=True):
+        # Returns False if no frame was received.
+
+        frame = self.get_frame(block)
+        if frame is None:
+            return False
+
+        self.decode_targets(frame, targets)
+        return True
+
     def get_data(self, full=False):
         frame = self.get_frame()
         if frame is None:
@@ -401,6 +811,81 @@ class LD2450():
 
         return self.parse_frame(frame, full=full)
 
+    @property
+    def reader_running(self):
+        return self._reader is not None
+
+    def start_reader(self, clean=True):
+        # Drains UART in background thread. Newest decoded targets are
+        # available via get_latest() without blocking.
+
+        if self._reader is not None:
+            return
+
+        if clean:
+            self.clean()
+
+        self._reader_stop.clear()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def stop_reader(self):
+        if self._reader is None:
+            return
+
+        self._reader_stop.set()
+        self._reader.join()
+        self._reader = None
+
+    def _read_loop(self):
+        # Targets are decoded into a ring of buffers, so the buffer being
+        # written is never the one just published.
+
+        ring = self._reader_targets
+        while not self._reader_stop.is_set():
+            seq = self._latest[0] + 1
+            targets = ring[seq % len(ring)]
+            targets.seq = 0
+
+            try:
+                ok = self.get_targets(targets)
+            except Exception as e:
+                logger.error(f"Radar reader failed\n{e}")
+                ok = False
+                time.sleep(1)
+
+            if not ok:
+                self.reader_n_failures += 1
+                continue
+
+            self.reader_n_failures = 0
+            targets.seq = seq
+
+            # Tuple is replaced in one assignment, so readers never see
+            # sequence number and data from different frames.
+            self._latest = (seq, targets)
+
+    def get_latest(self, targets):
+        # Copies targets of the newest frame decoded by reader thread into
+        # given targets and returns its sequence number (0 - no frame yet).
+
+        while True:
+            seq, latest = self._latest
+            if seq == 0:
+                return 0
+
+            targets.copy_from(latest)
+
+            # Buffer was reused by reader while being copied, retry.
+            if targets.seq == seq:
+                break
+
+        if seq > self._latest_read_seq:
+            self.n_dropped_frames += seq - self._latest_read_seq - 1
+            self._latest_read_seq = seq
+
+        return seq
+
     def show_data(self, n=None, clean=True):
         if clean:
             self.clean(ret=True)
@@ -483,18 +968,7 @@ if __name__ == "__main__":
     ##########
 
     r = LD2450(uartdev)
-
-    if bl == 1:
-        r.set_bluetooth_on(restart=True)
-    else:
-        r.set_bluetooth_off(restart=True)
-
-    if mt == 1:
-        r.set_multi_tracking()
-    else:
-        r.set_single_tracking()
-
-    r.set_zone_filtering(mode=0)
+    r.ensure_config(bluetooth=(bl == 1), multi_tracking=(mt == 1))
         
     ##########
 
@@ -0,0 +1,125 @@
+import math
+import time
+
+
+class Task():
+    def __init__(self, name, rate, func):
+        self.name = name
+        self.func = func
+        self.set_rate(rate)
+
+        self.deadline = None
+        self.reset_stats()
+        self.n_overruns_total = 0
+
+        # Optional histogram of run durations (see metrics).
+        self.histogram = None
+
+    def set_rate(self, rate):
+        if rate <= 0:
+            raise ValueError(f"Rate of task '{self.name}' must be positive.")
+
+        self.rate = rate
+        self.period = 1 / rate
+
+    def reset_stats(self):
+        self.n_runs = 0
+        self.n_overruns = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.duration_max = 0.0
+
+    @property
+    def jitter_mean(self):
+        if self.n_runs == 0:
+            return 0.0
+
+        return self.jitter_sum / self.n_runs
+
+    def run(self):
+        t_start = time.monotonic()
+        jitter = t_start - self.deadline
+        self.jitter_sum += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
+        self.func()
+
+        t_end = time.monotonic()
+        duration = t_end - t_start
+        self.duration_max = max(self.duration_max, duration)
+        self.n_runs += 1
+        if self.histogram is not None:
+            self.histogram.observe(duration)
+
+        self.deadline += self.period
+        if self.deadline <= t_end:
+            self.n_overruns += 1
+            self.n_overruns_total += 1
+            n_missed = math.ceil((t_end - self.deadline) / self.period)
+            self.deadline += n_missed * self.period
+
+
+class Scheduler():
+    # Runs tasks at fixed rates using monotonic deadlines.
+    #
+    # Jitter is delay between task deadline and actual start of the task.
+    # Overrun means task (or tasks before it) took so long that the next
+    # deadline was already missed; missed runs are skipped, not queued.
+
+    def __init__(self):
+        self.tasks = []
+
+    def add(self, name, rate, func):
+        task = Task(name, rate, func)
+        self.tasks.append(task)
+        return task
+
+    def get(self, name):
+        for task in self.tasks:
+            if task.name == name:
+                return task
+
+    def run_pending(self, now=None):
+        if now is None:
+            now = time.monotonic()
+
+        n = 0
+        for task in self.tasks:
+            if task.deadline is None:
+                task.deadline = now
+
+            if now < task.deadline:
+                continue
+
+            task.run()
+            n += 1
+
+        return n
+
+    def next_deadline(self):
+        deadlines = [t.deadline for t in self.tasks if t.deadline is not None]
+        if not deadlines:
+            return time.monotonic()
+
+        return min(deadlines)
+
+    def sleep(self):
+        delay = self.next_deadline() - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def report(self, reset=True):
+        lines = []
+        for task in self.tasks:
+            lines.append(
+                f"{task.name:>10}: {task.rate:5.1f} Hz"
+                f" | runs: {task.n_runs:6}"
+                f" | overruns: {task.n_overruns:6}"
+                f" | jitter mean: {task.jitter_mean*1000:7.2f} ms"
+                f" | jitter max: {task.jitter_max*1000:7.2f} ms"
+                f" | duration max: {task.duration_max*1000:7.2f} ms")
+
+            if reset:
+                task.reset_stats()
+
+        return "\n".join(lines)
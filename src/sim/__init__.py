@@ -0,0 +1,68 @@
+from sim.devices import FakeActuator, FakeRadar
+from sim.hardware import Hand, HardwarePWM
+from sim.mpv import FakeMPVServer
+
+
+class Simulation():
+    # Hardware-free environment for controller: fake MPV IPC server,
+    # pty-based radar and actuators. Devices are started on first request.
+    #
+    # Config (optional 'sim' section of conf.cfg):
+    # - mpv_socket: socket path of fake MPV (default '/tmp/mpvsocket-sim')
+    # - mpv_latency: delay of every MPV response, seconds (default 0)
+    # - video_duration: length of simulated video, seconds (default 60)
+    # - radar_rate: radar frames per second (default 10)
+
+    MPV_SOCKET = "/tmp/mpvsocket-sim"
+
+    def __init__(self, cfg=None):
+        if cfg is None:
+            cfg = {}
+
+        self.mpv_socket = cfg.get('mpv_socket', self.MPV_SOCKET)
+        self.mpv_latency = cfg.get('mpv_latency', 0)
+        self.video_duration = cfg.get('video_duration', 60)
+        self.radar_rate = cfg.get('radar_rate', 10)
+
+        self.mpv = None
+        self.radar = None
+        self.actuators = {}
+
+    def __del__(self):
+        try:
+            self.stop()
+        except:
+            pass
+
+    def get_mpv_socket(self):
+        if self.mpv is None:
+            self.mpv = FakeMPVServer(self.mpv_socket, self.mpv_latency,
+                                     self.video_duration)
+            self.mpv.start()
+
+        return self.mpv.socket_path
+
+    def get_radar_uartdev(self):
+        if self.radar is None:
+            self.radar = FakeRadar(self.radar_rate)
+            self.radar.start()
+
+        return self.radar.path
+
+    def get_actuator_uartdev(self, name):
+        if name not in self.actuators:
+            actuator = FakeActuator()
+            actuator.start()
+            self.actuators[name] = actuator
+
+        return self.actuators[name].path
+
+    def stop(self):
+        if self.mpv is not None:
+            self.mpv.stop()
+
+        if self.radar is not None:
+            self.radar.close()
+
+        for actuator in self.actuators.values():
+            actuator.close()
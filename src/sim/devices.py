@@ -0,0 +1,253 @@
+import math
+import os
+import select
+import struct
+import threading
+import time
+import tty
+
+
+class PtyDevice():
+    # Fake UART device on pseudo-terminal. Clients open 'path' like a real
+    # serial port; the device side is served by background thread.
+
+    POLL_PERIOD = 0.1
+
+    def __init__(self):
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.path = os.ttyname(self._slave)
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        if self._master is None:
+            return
+
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+        self._master = None
+        self._slave = None
+
+    def _write(self, data):
+        # Data not read by client is dropped when pty buffer is full.
+        try:
+            os.write(self._master, data)
+        except BlockingIOError:
+            pass
+
+    def _read(self, timeout):
+        r, _, _ = select.select([self._master], [], [], timeout)
+        if not r:
+            return b""
+
+        try:
+            return os.read(self._master, 4096)
+        except (BlockingIOError, OSError):
+            return b""
+
+    def _run(self):
+        while not self._stop.is_set():
+            data = self._read(self.POLL_PERIOD)
+            if data:
+                self.on_data(data)
+
+    def on_data(self, data):
+        pass
+
+
+class FakeRadar(PtyDevice):
+    # LD2450 stand-in: streams data frames at given rate and answers
+    # configuration commands. No frames are sent in configuration mode.
+    #
+    # Targets are synthetic: one person walking around in front of radar
+    # and, from time to time, another one standing further away.
+
+    CMD_HEADER = bytes([0xFD, 0xFC, 0xFB, 0xFA])
+    CMD_EOF = bytes([0x04, 0x03, 0x02, 0x01])
+
+    DATA_HEADER = bytes([0xAA, 0xFF, 0x03, 0x00])
+    DATA_EOF = bytes([0x55, 0xCC])
+    FRAME_TARGETS = struct.Struct("<12H")
+
+    RESTART_TIME = 0.2
+
+    def __init__(self, rate=10):
+        super().__init__()
+        self.period = 1 / rate
+
+        self.bluetooth = True
+        self.tracking_mode = 2
+        self.zone_filtering = 0
+        self._bluetooth_pending = self.bluetooth
+
+        self._in_configuration = False
+        self._rbuf = bytearray()
+        self._restart_until = 0
+        self._t0 = time.monotonic()
+
+        self.n_frames = 0
+        self.n_commands = 0
+
+    @staticmethod
+    def _encode_int16(v):
+        # Sign is in MSB (1 - positive, 0 - negative).
+        v = int(v)
+        if v >= 0:
+            return min(v, 2**15 - 1) + 2**15
+        return min(-v, 2**15 - 1)
+
+    def _targets(self, t):
+        targets = [(1200 * math.sin(2 * math.pi * t / 20),
+                    1500 + 1000 * math.sin(2 * math.pi * t / 13))]
+
+        if math.sin(2 * math.pi * t / 30) > 0:
+            targets.append((-800, 2800 + 300 * math.sin(t)))
+
+        return targets
+
+    def _frame(self, t):
+        values = [0] * 12
+        for i, (x, y) in enumerate(self._targets(t)):
+            values[4*i] = self._encode_int16(x)
+            values[4*i+1] = self._encode_int16(y)
+            values[4*i+3] = 320
+
+        return self.DATA_HEADER + self.FRAME_TARGETS.pack(*values) + self.DATA_EOF
+
+    def _run(self):
+        t_next = time.monotonic()
+        while not self._stop.is_set():
+            data = self._read(max(t_next - time.monotonic(), 0))
+            if data:
+                self.on_data(data)
+
+            t = time.monotonic()
+            if t < t_next:
+                continue
+
+            t_next += self.period
+            if t_next < t:
+                t_next = t + self.period
+
+            if self._in_configuration or (t < self._restart_until):
+                continue
+
+            self._write(self._frame(t - self._t0))
+            self.n_frames += 1
+
+    def on_data(self, data):
+        self._rbuf += data
+        while True:
+            i = self._rbuf.find(self.CMD_HEADER)
+            if i < 0:
+                self._rbuf.clear()
+                return
+
+            j = self._rbuf.find(self.CMD_EOF, i)
+            if j < 0:
+                del self._rbuf[:i]
+                return
+
+            cmd = bytes(self._rbuf[i+len(self.CMD_HEADER):j])
+            del self._rbuf[:j+len(self.CMD_EOF)]
+            self._on_cmd(cmd[2:4], cmd[4:])
+
+    def _respond(self, cmd_word, data=b""):
+        payload = bytes([cmd_word[0], cmd_word[1] | 0x01, 0x00, 0x00]) + data
+        self._write(self.CMD_HEADER + len(payload).to_bytes(2, 'little')
+                    + payload + self.CMD_EOF)
+
+    def _on_cmd(self, cmd_word, value):
+        self.n_commands += 1
+        word = int.from_bytes(cmd_word, 'little')
+
+        if word == 0x00FF:
+            self._in_configuration = True
+            self._respond(cmd_word, bytes([0x01, 0x00, 0x40, 0x00]))
+            return
+
+        if not self._in_configuration:
+            return
+
+        if word == 0x00FE:
+            self._in_configuration = False
+            self._respond(cmd_word)
+        elif word == 0x00A0:
+            self._respond(cmd_word, bytes([0x00, 0x00, 0x02, 0x01, 0x16, 0x24, 0x06, 0x22]))
+        elif word == 0x00A3:
+            self._respond(cmd_word)
+            self._in_configuration = False
+            self.bluetooth = self._bluetooth_pending
+            self._restart_until = time.monotonic() + self.RESTART_TIME
+        elif word == 0x00A4:
+            self._bluetooth_pending = bool(value[0])
+            self._respond(cmd_word)
+        elif word == 0x00A5:
+            if self.bluetooth:
+                self._respond(cmd_word, bytes([0x8F, 0x27, 0x2E, 0xB8, 0x0F, 0x65]))
+            else:
+                self._respond(cmd_word)
+        elif word == 0x0080:
+            self.tracking_mode = 1
+            self._respond(cmd_word)
+        elif word == 0x0090:
+            self.tracking_mode = 2
+            self._respond(cmd_word)
+        elif word == 0x0091:
+            self._respond(cmd_word, self.tracking_mode.to_bytes(2, 'little'))
+        elif word == 0x00C1:
+            self._respond(cmd_word, self.zone_filtering.to_bytes(2, 'little') + bytes(24))
+        elif word == 0x00C2:
+            self.zone_filtering = value[0]
+            self._respond(cmd_word)
+        else:
+            self._respond(cmd_word)
+
+
+class FakeActuator(PtyDevice):
+    # Serial actuator stand-in (baby, horse): consumes newline-terminated
+    # commands and keeps the last one.
+
+    def __init__(self):
+        super().__init__()
+        self._rbuf = bytearray()
+
+        self.last_command = None
+        self.n_commands = 0
+
+    def on_data(self, data):
+        self._rbuf += data
+        while True:
+            i = self._rbuf.find(b'\n')
+            if i < 0:
+                return
+
+            self.last_command = bytes(self._rbuf[:i]).decode(errors="replace")
+            del self._rbuf[:i+1]
+            self.n_commands += 1
@@ -0,0 +1,65 @@
+class Hand():
+    # No-op replacement of hand.Hand (no I2C servos or GPIO).
+
+    N_FINGERS = 5
+
+    def __init__(self, inverted=False, power_pin=10):
+        self.inverted = inverted
+
+        self._position = None
+        self._stopped = True
+
+        self.n_moves = 0
+
+    @property
+    def position(self):
+        return self._position
+
+    @property
+    def stopped(self):
+        return self._stopped
+
+    def set_finger_position(self, index, value):
+        self._stopped = False
+        self.n_moves += 1
+
+    def set_position(self, position, stop=False):
+        self._position = list(position)
+        self._stopped = stop
+        self.n_moves += 1
+
+    def set_position_by_name(self, name, stop=False):
+        self._position = name
+        self._stopped = stop
+        self.n_moves += 1
+
+    def start(self):
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+
+class HardwarePWM():
+    # No-op replacement of rpi_hardware_pwm.HardwarePWM.
+
+    def __init__(self, channel, hz, chip=0):
+        self.channel = channel
+        self.hz = hz
+        self.chip = chip
+
+        self.duty_cycle = 0
+        self.running = False
+
+    def start(self, initial_duty_cycle):
+        self.duty_cycle = initial_duty_cycle
+        self.running = True
+
+    def change_duty_cycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+
+    def change_frequency(self, hz):
+        self.hz = hz
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,182 @@
+import json
+import math
+from pathlib import Path
+import select
+import socket
+import threading
+import time
+
+
+class FakeMPVServer():
+    # Stand-in for MPV JSON IPC server. Answers commands used by MPVClient,
+    # keeps set properties, and pushes property-change events for observed
+    # properties. Every response is delayed by latency seconds, so requests
+    # pipelined on one connection queue up like on busy MPV.
+    #
+    # Playback is simulated as video of given duration played in loop
+    # (property 'time-remaining').
+
+    EVENT_PERIOD = 0.1
+
+    def __init__(self, socket_path, latency=0, duration=60):
+        self.socket_path = Path(socket_path)
+        self.latency = latency
+        self.duration = duration
+
+        self.properties = {
+            "pause": False,
+            "brightness": 0,
+            "drm-brightness": 0,
+        }
+        self._t0 = time.monotonic()
+
+        self.n_commands = 0
+
+        self._stop = threading.Event()
+        self._sock = None
+        self._thread = None
+
+    def get_property(self, name):
+        if name == "time-remaining":
+            elapsed = (time.monotonic() - self._t0) % self.duration
+            return self.duration - elapsed
+
+        return self.properties.get(name)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(str(self.socket_path))
+        self._sock.listen()
+        self._sock.settimeout(self.EVENT_PERIOD)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        self._sock.close()
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+
+            threading.Thread(target=self._serve, args=(conn,),
+                             daemon=True).start()
+
+    def _serve(self, conn):
+        buf = bytearray()
+        observed = {}
+        sent = {}
+
+        with conn:
+            while not self._stop.is_set():
+                r, _, _ = select.select([conn], [], [], self.EVENT_PERIOD)
+                if r:
+                    data = conn.recv(4096)
+                    if not data:
+                        return
+                    buf += data
+
+                out = []
+                while True:
+                    i = buf.find(b'\n')
+                    if i < 0:
+                        break
+
+                    line = bytes(buf[:i])
+                    del buf[:i+1]
+                    if line.strip():
+                        out.append(self._handle(line, observed))
+
+                for observe_id, name in observed.items():
+                    value = self.get_property(name)
+                    if isinstance(value, float):
+                        value = math.floor(value * 10) / 10
+
+                    if (observe_id not in sent) or (sent[observe_id] != value):
+                        sent[observe_id] = value
+                        out.append({"event": "property-change",
+                                    "id": observe_id, "name": name,
+                                    "data": value})
+
+                for msg in out:
+                    if ("request_id" in msg) and (self.latency > 0):
+                        time.sleep(self.latency)
+
+                    try:
+                        conn.sendall(json.dumps(msg).encode() + b'\n')
+                    except OSError:
+                        return
+
+    def _handle(self, line, observed):
+        self.n_commands += 1
+
+        try:
+            cmd_j = json.loads(line)
+            cmd = cmd_j["command"]
+        except (ValueError, KeyError, TypeError):
+            return {"error": "invalid parameter"}
+
+        res = {"error": "success", "request_id": cmd_j.get("request_id", 0)}
+
+        name = cmd[0]
+        if name == "get_property":
+            value = self.get_property(cmd[1])
+            if value is None:
+                res["error"] = "property unavailable"
+            else:
+                res["data"] = value
+        elif name == "set_property":
+            self.properties[cmd[1]] = cmd[2]
+        elif name == "observe_property":
+            observed[cmd[1]] = cmd[2]
+        elif name == "unobserve_property":
+            observed.pop(cmd[1], None)
+
+        return res
+
+
+if __name__ == "__main__":
+    import sys
+
+    try:
+        socket_path = sys.argv[1]
+    except:
+        socket_path = "/tmp/mpvsocket"
+
+    try:
+        latency = float(sys.argv[2])
+    except:
+        latency = 0
+
+    server = FakeMPVServer(socket_path, latency=latency)
+    server.start()
+    print(f"Fake MPV listening on '{socket_path}' (latency: {latency} s)")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+
+    server.stop()
@@ -0,0 +1,190 @@
+import math
+
+
+class KalmanAxis():
+    # Constant-velocity Kalman filter of one axis. State is position and
+    # velocity; acceleration is modelled as white noise with variance q,
+    # position measurements have variance r.
+
+    __slots__ = ("p", "v", "p00", "p01", "p11", "q", "r")
+
+    def __init__(self, p, q, r, v_var):
+        self.p = p
+        self.v = 0.0
+
+        self.p00 = r
+        self.p01 = 0.0
+        self.p11 = v_var
+
+        self.q = q
+        self.r = r
+
+    def predict(self, dt):
+        q = self.q
+        dt2 = dt * dt
+
+        self.p += self.v * dt
+
+        self.p00 += 2*dt*self.p01 + dt2*self.p11 + q*dt2*dt2/4
+        self.p01 += dt*self.p11 + q*dt2*dt/2
+        self.p11 += q*dt2
+
+    def update(self, z):
+        s = self.p00 + self.r
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+
+        e = z - self.p
+        self.p += k0 * e
+        self.v += k1 * e
+
+        self.p11 -= k1 * self.p01
+        self.p00 *= 1 - k0
+        self.p01 *= 1 - k0
+
+
+class Track():
+    def __init__(self, track_id, x, y, t, q, r, v_var):
+        self.id = track_id
+        self.kx = KalmanAxis(x, q, r, v_var)
+        self.ky = KalmanAxis(y, q, r, v_var)
+
+        self.t = t
+        self.t_update = t
+        self.n_hits = 1
+
+    @property
+    def x(self):
+        return self.kx.p
+
+    @property
+    def y(self):
+        return self.ky.p
+
+    @property
+    def vx(self):
+        return self.kx.v
+
+    @property
+    def vy(self):
+        return self.ky.v
+
+    @property
+    def distance(self):
+        return math.hypot(self.kx.p, self.ky.p)
+
+    @property
+    def angle(self):
+        return math.atan2(self.kx.p, self.ky.p)
+
+    def predict(self, horizon):
+        # Returns (x, y) expected after horizon seconds; track is not changed.
+        return (self.kx.p + self.kx.v * horizon,
+                self.ky.p + self.ky.v * horizon)
+
+    def advance(self, t):
+        dt = t - self.t
+        if dt > 0:
+            self.kx.predict(dt)
+            self.ky.predict(dt)
+            self.t = t
+
+    def update(self, x, y, t):
+        self.kx.update(x)
+        self.ky.update(y)
+        self.t_update = t
+        self.n_hits += 1
+
+
+class Tracker():
+    # Associates radar targets across frames and smooths each of them with
+    # Kalman filter, so every person keeps stable ID and position.
+    #
+    # Association is greedy nearest-neighbour: pairs of (track, target) are
+    # taken in order of distance between predicted track position and
+    # target, as long as distance is within gate. Unmatched targets start
+    # new tracks; tracks not updated for max_age seconds are dropped.
+    #
+    # Track is confirmed after min_hits updates. Primary track is kept
+    # while it exists, otherwise the nearest confirmed track is selected,
+    # so attention does not jump between people.
+
+    GATE = 600
+    MAX_AGE = 0.5
+    MIN_HITS = 3
+
+    # Acceleration variance (mm/s^2)^2, measurement variance mm^2 and
+    # initial velocity variance (mm/s)^2.
+    PROCESS_NOISE = 2000**2
+    MEASUREMENT_NOISE = 80**2
+    VELOCITY_VARIANCE = 1000**2
+
+    def __init__(self, gate=GATE, max_age=MAX_AGE, min_hits=MIN_HITS,
+                 process_noise=PROCESS_NOISE,
+                 measurement_noise=MEASUREMENT_NOISE):
+        self.gate = gate
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+
+        self.tracks = []
+        self.primary = None
+        self._next_id = 1
+
+    def reset(self):
+        self.tracks = []
+        self.primary = None
+
+    def update(self, targets, t):
+        # Consumes radar Targets measured at monotonic time t.
+
+        tracks = self.tracks
+        for track in tracks:
+            track.advance(t)
+
+        pairs = []
+        gate = self.gate
+        for i, track in enumerate(tracks):
+            for j in range(targets.n):
+                d = math.hypot(targets.x[j] - track.x, targets.y[j] - track.y)
+                if d < gate:
+                    pairs.append((d, i, j))
+        pairs.sort()
+
+        matched_tracks = set()
+        matched_targets = set()
+        for d, i, j in pairs:
+            if (i in matched_tracks) or (j in matched_targets):
+                continue
+
+            tracks[i].update(targets.x[j], targets.y[j], t)
+            matched_tracks.add(i)
+            matched_targets.add(j)
+
+        self.tracks = [track for track in tracks
+                       if t - track.t_update <= self.max_age]
+
+        for j in range(targets.n):
+            if j in matched_targets:
+                continue
+
+            self.tracks.append(Track(
+                self._next_id, targets.x[j], targets.y[j], t,
+                self.process_noise, self.measurement_noise,
+                self.VELOCITY_VARIANCE))
+            self._next_id += 1
+
+        self._select_primary()
+        return self.primary
+
+    def _select_primary(self):
+        if (self.primary is not None) and (self.primary in self.tracks):
+            return
+
+        confirmed = [track for track in self.tracks
+                     if track.n_hits >= self.min_hits]
+        if confirmed:
+            self.primary = min(confirmed, key=lambda track: track.distance)
+        else:
+            self.primary = None
@@ -0,0 +1,106 @@
+import sys
+import types
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+# Hand needs Raspberry Pi GPIO and I2C. Both are replaced: GPIO calls do
+# nothing and PCA9685 registers live on fake I2C bus, so that adafruit
+# libraries (real ones) write to it as to the chip.
+
+class FakeI2C():
+    def __init__(self, scl=None, sda=None):
+        self.regs = bytearray(256)
+        self.regs[0xFE] = 0x1E  # PRE_SCALE power-on value
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def writeto(self, address, buf, *, start=0, end=None):
+        data = bytes(buf[start:end])
+        if not data:
+            return
+
+        # Register address followed by data, auto-incremented.
+        reg = data[0]
+        self.regs[reg:reg+len(data)-1] = data[1:]
+
+    def writeto_then_readfrom(self, address, out_buffer, in_buffer, *,
+                              out_start=0, out_end=None, in_start=0, in_end=None):
+        reg = out_buffer[out_start]
+        if in_end is None:
+            in_end = len(in_buffer)
+        in_buffer[in_start:in_end] = self.regs[reg:reg+in_end-in_start]
+
+
+def install_fake_hardware():
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BCM = gpio.OUT = gpio.HIGH = gpio.LOW = 0
+    gpio.setmode = gpio.setup = gpio.output = lambda *args: None
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+
+    board = types.ModuleType("board")
+    board.SCL = board.SDA = None
+    busio = types.ModuleType("busio")
+    busio.I2C = FakeI2C
+
+    sys.modules.update({"RPi": rpi, "RPi.GPIO": gpio, "board": board, "busio": busio})
+
+
+try:
+    import adafruit_motor
+    import adafruit_pca9685
+except ImportError:
+    adafruit_motor = None
+
+
+@unittest.skipIf(adafruit_motor is None, "adafruit libraries not installed")
+class TestBulkPose(unittest.TestCase):
+    def setUp(self):
+        install_fake_hardware()
+        import hand
+        self.Hand = hand.Hand
+
+    def channel_regs(self, h, position):
+        # LED0..LED4 registers after writing every finger separately.
+        bus = h._pca.i2c_device.i2c
+        for i in range(h.N_FINGERS):
+            _, angle = h._convert(i, position[i])
+            h._finger(i).angle = angle
+
+        start = h.LED0_ON_L
+        return bytes(bus.regs[start:start+4*h.N_FINGERS])
+
+    def test_block_matches_channel_writes(self):
+        for inverted in [False, True]:
+            h = self.Hand(inverted=inverted)
+            self.assertTrue(h._bulk)
+
+            for name, position in h.POSITIONS.items():
+                if None in position:
+                    continue
+
+                with self.subTest(inverted=inverted, position=name):
+                    _, _, block = h._get_pose(position)
+                    self.assertEqual(block[0], h.LED0_ON_L)
+                    self.assertEqual(block[1:], self.channel_regs(h, position))
+
+    def test_set_position_writes_block(self):
+        h = self.Hand()
+        bus = h._pca.i2c_device.i2c
+        start = h.LED0_ON_L
+
+        for name in ["open", "3", "close"]:
+            h.set_position_by_name(name)
+            regs = bytes(bus.regs[start:start+4*h.N_FINGERS])
+            self.assertEqual(regs, self.channel_regs(h, h.POSITIONS[name]))
+
+
+if __name__ == "__main__":
+    unittest.main()